@@ -0,0 +1,369 @@
+import asyncio
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+import metrics
+
+# Whole answer, including failover and hedging
+AI_DEADLINE = float(os.getenv("AI_DEADLINE", 45))
+# A provider that has not produced its first chunk by then is abandoned
+AI_FIRST_CHUNK_TIMEOUT = float(os.getenv("AI_FIRST_CHUNK_TIMEOUT", 12))
+# Longest silence allowed between two chunks once an answer is streaming
+AI_CHUNK_TIMEOUT = float(os.getenv("AI_CHUNK_TIMEOUT", 15))
+# Share of requests that may get a hedged second request (0 disables hedging)
+AI_HEDGE_RATIO = float(os.getenv("AI_HEDGE_RATIO", 0.1))
+
+# Optional second provider: any OpenAI-compatible endpoint (OpenAI, Groq, vLLM, Ollama, ...)
+AI_FALLBACK_BASE_URL = os.getenv("AI_FALLBACK_BASE_URL")
+AI_FALLBACK_API_KEY = os.getenv("AI_FALLBACK_API_KEY", "none")
+AI_FALLBACK_MODEL = os.getenv("AI_FALLBACK_MODEL", "gpt-4o-mini")
+
+
+class AIUnavailableError(Exception):
+    pass
+
+
+# --- PROVIDERS ---
+class Provider(ABC):
+    """
+    One LLM backend. `stream()` yields the answer in text chunks; `history`
+    is an optional memory.Context (summary + recent turns).
+    """
+
+    name = "provider"
+
+    @property
+    def available(self):
+        return True
+
+    def prepare(self):
+        """Slow one-time setup (imports, clients); run in a worker thread at startup."""
+
+    @abstractmethod
+    def stream(self, system, user_text, history=None):
+        """An async iterator of text chunks."""
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    def __init__(self, get_model):
+        # The model is discovered in the background after startup (ai_service.connect_model)
+        self.get_model = get_model
+
+    @property
+    def available(self):
+        return self.get_model() is not None
+
+    @staticmethod
+    def prompt(system, user_text, history=None):
+        parts = [system]
+        if history and history.summary:
+            parts.append(history.summary)
+        if history and history.turns:
+            parts.append("Conversation so far:\n" + "\n".join(f"User: {q}\nAssistant: {a}" for q, a in history.turns))
+        parts.append(f"User Question: {user_text}")
+        return "\n\n".join(parts)
+
+    async def stream(self, system, user_text, history=None):
+        response = await self.get_model().generate_content_async(self.prompt(system, user_text, history), stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class OpenAIProvider(Provider):
+    """Any endpoint speaking the OpenAI chat completions API."""
+
+    def __init__(self, base_url, api_key, model, name="fallback"):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.name = name
+        self._client = None
+
+    def prepare(self):
+        self.client()
+
+    def client(self):
+        if self._client is None:
+            # Imported on first use to keep it off the startup path
+            from openai import AsyncOpenAI
+            # Retries and timeouts are handled by AIBackend
+            self._client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0, timeout=AI_DEADLINE)
+        return self._client
+
+    @staticmethod
+    def messages(system, user_text, history=None):
+        if history and history.summary:
+            system = f"{system}\n{history.summary}"
+        messages = [{"role": "system", "content": system}]
+        for question, answer in (history.turns if history else ()):
+            messages += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        messages.append({"role": "user", "content": user_text})
+        return messages
+
+    async def stream(self, system, user_text, history=None):
+        response = await self.client().chat.completions.create(
+            model=self.model, messages=self.messages(system, user_text, history), stream=True)
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
+
+
+# --- HEALTH ---
+class CircuitBreaker:
+    """
+    Per-provider breaker over the last `window` calls. It opens when too many
+    of them failed or were slow (first chunk later than `slow_call` seconds),
+    rejects calls for `cooldown` seconds, then lets a single trial call
+    through: success closes it, failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name="", window=20, min_calls=5, error_rate=0.5, slow_rate=0.5, slow_call=8.0, cooldown=30.0):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._trial = False
+        self._calls = deque(maxlen=window)   # (failed, slow)
+
+    def allow(self):
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state, self._trial = self.HALF_OPEN, False
+        if self.state == self.HALF_OPEN:
+            if self._trial:
+                return False
+            self._trial = True
+        return True
+
+    def record(self, ok, latency=None):
+        slow = latency is not None and latency > self.slow_call
+        if self.state == self.HALF_OPEN:
+            self._trial = False
+            if ok and not slow:
+                self.state = self.CLOSED
+                self._calls.clear()
+            else:
+                self._trip()
+            return
+
+        self._calls.append((not ok, slow))
+        if len(self._calls) < self.min_calls:
+            return
+        failed = sum(1 for f, _ in self._calls if f) / len(self._calls)
+        slowed = sum(1 for _, s in self._calls if s) / len(self._calls)
+        if failed >= self.error_rate or slowed >= self.slow_rate:
+            self._trip()
+
+    def release(self):
+        # A half-open trial that was cancelled (lost a hedge) tells us nothing
+        if self.state == self.HALF_OPEN:
+            self._trial = False
+
+    def _trip(self):
+        if self.state != self.OPEN:
+            logging.warning(f"AI circuit breaker for {self.name} opened for {self.cooldown:.0f}s")
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._calls.clear()
+
+
+class _Slot:
+    """A provider with its breaker and recent first-chunk latencies."""
+
+    def __init__(self, provider, breaker):
+        self.provider = provider
+        self.breaker = breaker
+        self.latencies = deque(maxlen=200)
+
+    def p95(self, min_samples=20):
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95)]
+
+
+class _Attempt:
+    def __init__(self, slot, request, hedge=False):
+        self.slot = slot
+        self.hedge = hedge
+        self.started = asyncio.get_running_loop().time()
+        self.gen = slot.provider.stream(*request)
+        self.first = asyncio.ensure_future(anext(self.gen))
+
+    async def close(self):
+        if not self.first.done():
+            self.first.cancel()
+            await asyncio.gather(self.first, return_exceptions=True)
+        await self.gen.aclose()
+
+
+class AIBackend:
+    """
+    Providers in priority order. A request goes to the first healthy one;
+    if it fails or has not started answering within AI_FIRST_CHUNK_TIMEOUT
+    the next one is tried. When the first chunk is later than that
+    provider's recent p95, a hedged request is started on the next provider
+    (or the same one if it is the only one) and whichever answers first
+    wins. Everything is bounded by AI_DEADLINE.
+    """
+
+    def __init__(self, providers, deadline=AI_DEADLINE, first_chunk_timeout=AI_FIRST_CHUNK_TIMEOUT,
+                 chunk_timeout=AI_CHUNK_TIMEOUT, hedge_ratio=AI_HEDGE_RATIO, breaker=CircuitBreaker):
+        self.slots = [_Slot(p, breaker(name=p.name)) for p in providers]
+        self.deadline = deadline
+        self.first_chunk_timeout = first_chunk_timeout
+        self.chunk_timeout = chunk_timeout
+        self.hedge_ratio = hedge_ratio
+        self.stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'failovers': 0, 'unavailable': 0}
+
+    @property
+    def available(self):
+        return any(slot.provider.available for slot in self.slots)
+
+    async def prepare(self):
+        for slot in self.slots:
+            await asyncio.to_thread(slot.provider.prepare)
+
+    def breaker_states(self):
+        return {slot.provider.name: slot.breaker.state for slot in self.slots}
+
+    def _may_hedge(self):
+        return self.stats['hedged'] < self.hedge_ratio * self.stats['requests']
+
+    def _failed(self, attempt, outcome, error=None):
+        attempt.slot.breaker.record(False)
+        name = attempt.slot.provider.name
+        metrics.inc("dvbot_ai_attempts_total", provider=name, outcome=outcome)
+        logging.warning(f"AI provider {name} {outcome}: {error!r}" if error else f"AI provider {name} {outcome}")
+
+    async def stream(self, system, user_text, history=None):
+        loop = asyncio.get_running_loop()
+        request = (system, user_text, history)
+        deadline = loop.time() + self.deadline
+        self.stats['requests'] += 1
+        queue = [slot for slot in self.slots if slot.provider.available]
+        attempts = []
+        winner = None
+        first_chunk = None
+        hedge_at = None
+
+        def launch(hedge=False):
+            # Skip providers whose breaker is open; the same slot may be reused for a hedge
+            while queue:
+                slot = queue.pop(0)
+                if slot.breaker.allow():
+                    attempts.append(_Attempt(slot, request, hedge))
+                    return True
+            return False
+
+        try:
+            if not launch():
+                raise AIUnavailableError("no AI provider available")
+            primary = attempts[0].slot
+            p95 = primary.p95()
+            if p95 is not None and self.hedge_ratio > 0:
+                hedge_at = attempts[0].started + p95
+
+            # --- Wait for the first chunk from any attempt ---
+            while winner is None:
+                now = loop.time()
+                if now >= deadline:
+                    raise AIUnavailableError("AI deadline exceeded")
+                wake = min([deadline] + [a.started + self.first_chunk_timeout for a in attempts]
+                           + ([hedge_at] if hedge_at else []))
+                if attempts:
+                    await asyncio.wait([a.first for a in attempts], timeout=max(0, wake - now),
+                                       return_when=asyncio.FIRST_COMPLETED)
+                now = loop.time()
+
+                for attempt in list(attempts):
+                    if attempt.first.done():
+                        attempts.remove(attempt)
+                        error = attempt.first.exception()
+                        if error is None and winner is None:
+                            winner, first_chunk = attempt, attempt.first.result()
+                            continue
+                        if error is None:
+                            await attempt.close()   # a second success in the same tick
+                            attempt.slot.breaker.release()
+                            continue
+                        await attempt.close()
+                        self._failed(attempt, 'empty' if isinstance(error, StopAsyncIteration) else 'error', error)
+                    elif now >= attempt.started + self.first_chunk_timeout:
+                        attempts.remove(attempt)
+                        await attempt.close()
+                        self._failed(attempt, 'timeout')
+                    else:
+                        continue
+                    if winner is None and not attempts:
+                        if not launch():
+                            raise AIUnavailableError("all AI providers failed")
+                        self.stats['failovers'] += 1
+
+                if winner is None and hedge_at and now >= hedge_at:
+                    hedge_at = None
+                    if self._may_hedge():
+                        if not queue:
+                            queue.append(primary)
+                        if launch(hedge=True):
+                            self.stats['hedged'] += 1
+
+            # --- The winner streams the rest; losers are cancelled ---
+            for attempt in attempts:
+                await attempt.close()
+                attempt.slot.breaker.release()
+                metrics.inc("dvbot_ai_attempts_total", provider=attempt.slot.provider.name, outcome='hedge_lost')
+            attempts = [winner]
+            slot, name = winner.slot, winner.slot.provider.name
+            latency = loop.time() - winner.started
+            slot.latencies.append(latency)
+            slot.breaker.record(True, latency)
+            if winner.hedge:
+                self.stats['hedge_wins'] += 1
+            metrics.observe("dvbot_ai_first_chunk_seconds", latency, provider=name)
+
+            yield first_chunk
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise AIUnavailableError("AI deadline exceeded mid-answer")
+                try:
+                    chunk = await asyncio.wait_for(anext(winner.gen), min(remaining, self.chunk_timeout))
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    self._failed(winner, 'stream_error', e)
+                    raise AIUnavailableError("AI answer interrupted") from e
+                yield chunk
+
+            metrics.inc("dvbot_ai_attempts_total", provider=name, outcome='ok')
+            metrics.observe("dvbot_ai_seconds", loop.time() - winner.started, provider=name)
+        except AIUnavailableError:
+            self.stats['unavailable'] += 1
+            raise
+        finally:
+            for attempt in attempts:
+                await attempt.close()
+
+
+def default_providers(get_gemini_model):
+    providers = [GeminiProvider(get_gemini_model)]
+    if AI_FALLBACK_BASE_URL:
+        providers.append(OpenAIProvider(AI_FALLBACK_BASE_URL, AI_FALLBACK_API_KEY, AI_FALLBACK_MODEL))
+    return providers
@@ -1,49 +1,86 @@
+import asyncio
+import hashlib
+import json
+import logging
 import os
-import google.generativeai as genai
+import time
+import unicodedata
+from collections import deque
+from contextlib import asynccontextmanager
+from cachetools import TLRUCache, TTLCache
 from dotenv import load_dotenv
+import metrics
+from ai_providers import AIBackend, AIUnavailableError, default_providers
+from memory import ConversationMemory
+from ratelimit import TokenBucket
 
 # Setup
 load_dotenv()
 api_key = os.getenv("GEMINI_API_KEY")
 
+# The chosen model name is remembered on disk so restarts skip list_models()
+MODEL_CACHE_FILE = os.getenv("AI_MODEL_CACHE", ".ai_model.json")
+MODEL_CACHE_TTL = int(os.getenv("AI_MODEL_CACHE_TTL", 24 * 3600))
+
 model = None
 
-if api_key:
+def _pick_model():
+    # google.generativeai pulls in grpc/protobuf; import it here, off the startup path
+    import google.generativeai as genai
     genai.configure(api_key=api_key)
-    print("🔄 Connecting to AI...")
+
+    try:
+        with open(MODEL_CACHE_FILE) as f:
+            cached = json.load(f)
+        if cached['saved_at'] + MODEL_CACHE_TTL > time.time():
+            return genai, cached['model'], True
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # 1. Ask Google what models are available for this Key
+    available_models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+    
+    # 2. Smart Selection Logic
+    chosen_model = None
     
+    # Preference List (Newest to Oldest)
+    preferences = ['models/gemini-1.5-flash', 'models/gemini-pro', 'models/gemini-1.0-pro']
+    
+    # Try to find a preferred model
+    for pref in preferences:
+        if pref in available_models:
+            chosen_model = pref
+            break
+    
+    # Fallback: Just take the first one available
+    if not chosen_model and available_models:
+        chosen_model = available_models[0]
+
+    if chosen_model:
+        with open(MODEL_CACHE_FILE, 'w') as f:
+            json.dump({'model': chosen_model, 'saved_at': time.time()}, f)
+    return genai, chosen_model, False
+
+async def connect_model():
+    """Import the AI SDKs and choose a Gemini model in worker threads; call once after startup."""
+    global model
+    await backend.prepare()
+    if not api_key:
+        print("⚠️ Warning: GEMINI_API_KEY not found.")
+        return
+    print("🔄 Connecting to AI...")
+    started = time.perf_counter()
     try:
-        # 1. Ask Google what models are available for this Key
-        available_models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-        
-        # 2. Smart Selection Logic
-        chosen_model = None
-        
-        # Preference List (Newest to Oldest)
-        preferences = ['models/gemini-1.5-flash', 'models/gemini-pro', 'models/gemini-1.0-pro']
-        
-        # Try to find a preferred model
-        for pref in preferences:
-            if pref in available_models:
-                chosen_model = pref
-                break
-        
-        # Fallback: Just take the first one available
-        if not chosen_model and available_models:
-            chosen_model = available_models[0]
-            
+        genai, chosen_model, from_cache = await asyncio.to_thread(_pick_model)
         if chosen_model:
-            print(f"✅ AI Connected using: {chosen_model}")
             model = genai.GenerativeModel(chosen_model)
+            source = "cached" if from_cache else "discovered"
+            print(f"✅ AI Connected using: {chosen_model} ({source} in {time.perf_counter() - started:.2f}s)")
         else:
             print("❌ No text-generation models found for this API Key.")
-            
     except Exception as e:
         print(f"❌ Connection Error: {e}")
 
-else:
-    print("⚠️ Warning: GEMINI_API_KEY not found.")
-
 SYSTEM_PROMPT = """
 You are a helpful, professional Ethiopian consultant for the USA Diversity Visa (DV) Program. 
 - Answer clearly and concisely.
@@ -53,13 +90,229 @@ You are a helpful, professional Ethiopian consultant for the USA Diversity Visa
 - Photo Rule: White background, no glasses, look straight.
 """
 
-async def ask_gemini(user_text):
-    if not model:
-        return "⚠️ System Error: AI model is not connected. Please check server logs."
-    
+# --- RESPONSE CACHE ---
+# Bump automatically whenever SYSTEM_PROMPT changes so stale answers are never served
+PROMPT_VERSION = hashlib.sha1(SYSTEM_PROMPT.encode()).hexdigest()[:8]
+CACHE_TTL = int(os.getenv("AI_CACHE_TTL", 6 * 3600))
+CACHE_FILE = os.getenv("AI_CACHE_FILE")  # optional, e.g. "ai_cache.json"
+
+# Values are (answer, created_at); each entry expires CACHE_TTL seconds after it was created
+_cache = TLRUCache(
+    maxsize=int(os.getenv("AI_CACHE_SIZE", 1024)),
+    ttu=lambda key, value, now: value[1] + CACHE_TTL,
+    timer=time.time,
+)
+cache_stats = {'hits': 0, 'misses': 0}
+
+def detect_lang(text):
+    # Any Ethiopic character means Amharic
+    return 'am' if any('\u1200' <= ch <= '\u137f' for ch in text) else 'en'
+
+def normalize_question(text):
+    text = unicodedata.normalize('NFKC', text).casefold()
+    # Drop punctuation and symbols (covers Ethiopic ። ፣ ፧ and emoji too)
+    kept = (' ' if unicodedata.category(ch)[0] in 'PS' else ch for ch in text)
+    return ' '.join(''.join(kept).split())
+
+def cache_key(user_text):
+    return f"{PROMPT_VERSION}:{detect_lang(user_text)}:{normalize_question(user_text)}"
+
+def load_cache():
+    if not CACHE_FILE or not os.path.exists(CACHE_FILE):
+        return
     try:
-        prompt = f"{SYSTEM_PROMPT}\n\nUser Question: {user_text}"
-        response = await model.generate_content_async(prompt)
-        return response.text
+        with open(CACHE_FILE, encoding='utf-8') as f:
+            entries = json.load(f)
+        now = time.time()
+        for key, (answer, created_at) in entries.items():
+            if key.startswith(PROMPT_VERSION + ':') and created_at + CACHE_TTL > now:
+                _cache[key] = (answer, created_at)
+        print(f"📦 Loaded {len(_cache)} cached AI answers")
     except Exception as e:
-        return f"Sorry, I am having trouble connecting to the AI right now. Error: {str(e)}"
\ No newline at end of file
+        print(f"⚠️ Could not load AI cache: {e}")
+
+def save_cache():
+    if not CACHE_FILE:
+        return
+    tmp = f"{CACHE_FILE}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({k: list(v) for k, v in _cache.items()}, f, ensure_ascii=False)
+    os.replace(tmp, CACHE_FILE)
+
+load_cache()
+
+# --- REQUEST SCHEDULER ---
+class AIBusyError(Exception):
+    pass
+
+class AIScheduler:
+    """
+    Admission control for LLM calls: at most `max_concurrency` calls run at
+    once, the rest wait in a bounded FIFO queue. Each user also has a token
+    bucket so one person cannot fill the queue. When the queue is full (or
+    the user is over their rate) the call is rejected immediately with
+    AIBusyError instead of piling up coroutines.
+    """
+
+    def __init__(self, max_concurrency=4, max_queue=50, user_rate=1 / 10, user_burst=3):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.active = 0
+        self._waiters = deque()
+        # Buckets of users that went quiet are dropped; a fresh one starts full anyway
+        self._buckets = TTLCache(maxsize=50_000, ttl=max(60, user_burst / user_rate))
+        self._wait_times = deque(maxlen=1000)
+        self.stats = {'admitted': 0, 'rejected_queue': 0, 'rejected_rate': 0, 'max_queue_depth': 0}
+
+    def _check_rate(self, user_id):
+        if user_id is None:
+            return
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        if not bucket.try_take():
+            self.stats['rejected_rate'] += 1
+            raise AIBusyError("user rate limit")
+
+    async def _acquire(self):
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.stats['rejected_queue'] += 1
+            raise AIBusyError("queue full")
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self._waiters))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # The slot was already handed to us; pass it on
+                self._release()
+            else:
+                self._waiters.remove(fut)
+            raise
+
+    def _release(self):
+        # Hand the slot directly to the oldest waiter so ordering stays FIFO
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, user_id=None):
+        self._check_rate(user_id)
+        queued_at = time.perf_counter()
+        await self._acquire()
+        self._wait_times.append(time.perf_counter() - queued_at)
+        self.stats['admitted'] += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def snapshot(self):
+        waits = sorted(self._wait_times)
+        return {
+            **self.stats,
+            'active': self.active,
+            'queue_depth': len(self._waiters),
+            'wait_p50': waits[len(waits) // 2] if waits else 0.0,
+            'wait_p95': waits[int(len(waits) * 0.95)] if waits else 0.0,
+        }
+
+scheduler = AIScheduler(
+    max_concurrency=int(os.getenv("AI_MAX_CONCURRENCY", 4)),
+    max_queue=int(os.getenv("AI_MAX_QUEUE", 50)),
+    user_rate=1 / float(os.getenv("AI_USER_INTERVAL", 10)),
+    user_burst=int(os.getenv("AI_USER_BURST", 3)),
+)
+
+BUSY_MSG = {
+    'en': "⏳ The AI helper is busy right now. Please try again in a minute.",
+    'am': "⏳ AI ረዳቱ አሁን ተጨናንቋል። እባክዎ ከአንድ ደቂቃ በኋላ እንደገና ይሞክሩ።",
+}
+
+NOT_CONNECTED_MSG = "⚠️ System Error: AI model is not connected. Please check server logs."
+
+# Shown instead of the raw exception; details go to the log
+UNAVAILABLE_MSG = {
+    'en': "⚠️ The AI helper is not responding right now. Please try again in a few minutes.",
+    'am': "⚠️ AI ረዳቱ አሁን ምላሽ እየሰጠ አይደለም። እባክዎ ከጥቂት ደቂቃዎች በኋላ እንደገና ይሞክሩ።",
+}
+
+# Gemini first, then the optional OpenAI-compatible fallback (see ai_providers.py)
+backend = AIBackend(default_providers(lambda: model))
+
+# Recent AI-helper turns per user, so follow-up questions keep their context
+conversations = ConversationMemory(
+    max_turns=int(os.getenv("AI_MEMORY_TURNS", 6)),
+    max_users=int(os.getenv("AI_MEMORY_USERS", 5000)),
+    idle_ttl=int(os.getenv("AI_MEMORY_IDLE", 1800)),
+    token_budget=int(os.getenv("AI_MEMORY_TOKENS", 700)),
+)
+
+def _cached_answer(key):
+    if not key:
+        return None
+    hit = _cache.get(key)
+    if hit is not None:
+        cache_stats['hits'] += 1
+        return hit[0]
+    cache_stats['misses'] += 1
+    return None
+
+async def ask_gemini(user_text, use_cache=True, user_id=None):
+    return ''.join([chunk async for chunk in stream_gemini(user_text, use_cache, user_id)])
+
+async def stream_gemini(user_text, use_cache=True, user_id=None, remember=False):
+    """
+    Yield the answer in chunks as the provider produces them (one chunk on a cache hit).
+    With `remember`, the user's recent turns are sent along and the new turn is stored.
+    """
+    history = conversations.context(user_id) if remember and user_id is not None else None
+    if history is not None and not history.empty:
+        # A follow-up depends on what came before; a cached stand-alone answer would be wrong
+        use_cache = False
+    key = cache_key(user_text) if use_cache else None
+    cached = _cached_answer(key)
+    if cached is not None:
+        if history is not None:
+            conversations.add(user_id, user_text, cached)
+        yield cached
+        return
+
+    if not backend.available:
+        yield NOT_CONNECTED_MSG
+        return
+
+    parts = []
+    try:
+        # The slot is held for the whole stream, not just the first chunk
+        async with scheduler.slot(user_id):
+            async for chunk in backend.stream(SYSTEM_PROMPT, user_text, history):
+                parts.append(chunk)
+                yield chunk
+    except AIBusyError:
+        metrics.inc("dvbot_ai_requests_total", outcome='busy')
+        yield BUSY_MSG[detect_lang(user_text)]
+        return
+    except AIUnavailableError as e:
+        logging.warning(f"AI answer failed: {e}")
+        metrics.inc("dvbot_ai_requests_total", outcome='unavailable')
+        yield ("\n\n" if parts else "") + UNAVAILABLE_MSG[detect_lang(user_text)]
+        return
+
+    metrics.inc("dvbot_ai_requests_total", outcome='ok')
+    if history is not None and parts:
+        conversations.add(user_id, user_text, ''.join(parts))
+    # Only complete answers are cached
+    if key and parts:
+        _cache[key] = (''.join(parts), time.time())
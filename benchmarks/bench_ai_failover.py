@@ -0,0 +1,92 @@
+"""
+AI backend resilience benchmark: two stub OpenAI-compatible servers (primary
+and fallback) behind ai_providers.AIBackend, with the primary degraded in
+different ways. Shows how long answers take and who served them.
+
+    python benchmarks/bench_ai_failover.py [--requests 200] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stub_llm_server  # noqa: E402
+from ai_providers import AIBackend, AIUnavailableError, OpenAIProvider  # noqa: E402
+
+# (name, primary config); the fallback is always healthy but slower
+SCENARIOS = [
+    ("healthy", {}),
+    ("10% slow (10s)", {'slow_rate': 0.1}),
+    ("30% errors", {'error_rate': 0.3}),
+    ("20% hang", {'hang_rate': 0.2}),
+    ("down", {'error_rate': 1.0}),
+]
+
+
+async def run_scenario(name, primary_config, args):
+    primary_app = stub_llm_server.make_app(latency=0.2, **primary_config)
+    fallback_app = stub_llm_server.make_app(latency=0.6)
+    runners = []
+    try:
+        runner, primary_url = await stub_llm_server.start(primary_app)
+        runners.append(runner)
+        runner, fallback_url = await stub_llm_server.start(fallback_app)
+        runners.append(runner)
+        backend = AIBackend(
+            [OpenAIProvider(primary_url, "x", "stub", name="primary"),
+             OpenAIProvider(fallback_url, "x", "stub", name="fallback")],
+            deadline=args.deadline, first_chunk_timeout=args.first_chunk_timeout, hedge_ratio=args.hedge_ratio,
+        )
+        await backend.prepare()
+
+        gate = asyncio.Semaphore(args.concurrency)
+        latencies, failed = [], 0
+
+        async def one(i):
+            nonlocal failed
+            async with gate:
+                started = time.perf_counter()
+                try:
+                    async for _chunk in backend.stream("system", f"question {i}"):
+                        pass
+                    latencies.append(time.perf_counter() - started)
+                except AIUnavailableError:
+                    failed += 1
+
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        latencies.sort()
+        pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0  # noqa: E731
+        s = backend.stats
+        print(f"{name:<16} p50 {pct(0.5):5.2f}s  p95 {pct(0.95):5.2f}s  p99 {pct(0.99):5.2f}s  max {pct(1):5.2f}s  "
+              f"failed {failed:>3}  primary/fallback calls {primary_app['stats']['requests']:>3}/"
+              f"{fallback_app['stats']['requests']:>3}  hedged {s['hedged']:>2} (won {s['hedge_wins']:>2})  "
+              f"failovers {s['failovers']:>3}  breaker {backend.breaker_states()['primary']}")
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+async def main_async(args):
+    for name, config in SCENARIOS:
+        await run_scenario(name, config, args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--deadline", type=float, default=8)
+    parser.add_argument("--first-chunk-timeout", type=float, default=2)
+    parser.add_argument("--hedge-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
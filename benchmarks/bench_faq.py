@@ -0,0 +1,123 @@
+"""
+FAQ index benchmark: hit rate on a sample of realistic user questions and
+per-lookup latency, plus a held-out set of paraphrases and adjacent-topic
+questions that are not in faq_data.json. Exits with status 1 if any
+question the FAQ must not answer gets a local answer (a wrong answer is
+worse than an AI call).
+
+    python benchmarks/bench_faq.py [--threshold 0.4] [--rounds 2000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from faq import FAQ_THRESHOLD, FAQIndex  # noqa: E402
+
+# (question, should the FAQ answer it?)
+SAMPLES = [
+    ("how much is the fee", True),
+    ("What's the price for the service?", True),
+    ("how much will i pay", True),
+    ("ክፍያው ስንት ብር ነው", True),
+    ("ዋጋው ስንት ነው", True),
+    ("is dv free?", True),
+    ("ዲቪ ነፃ ነው", True),
+    ("photo requirements please", True),
+    ("can i wear glasses in my photo", True),
+    ("የፎቶ መስፈርት ምንድነው", True),
+    ("when is the deadline for dv", True),
+    ("ዲቪ መቼ ይዘጋል", True),
+    ("do i need to add my children", True),
+    ("how can i pay with telebirr", True),
+    ("when will results be out", True),
+    ("ውጤት መቼ ይወጣል", True),
+    ("I was born in Kenya but live in Ethiopia, which country do I use?", False),
+    ("my passport expired, can I still apply?", False),
+    ("what is the education requirement", False),
+    ("what are the requirements", False),
+    ("is there an age requirement", False),
+    ("who is eligible for dv", False),
+    ("can I apply if I am 17", False),
+    ("ሰላም እንዴት ነህ", False),
+]
+
+# Held out: nothing below is in faq_data.json (not even as a negative row). Paraphrases the FAQ
+# should answer, and questions on neighbouring topics (interview, visa, medical exam) that share
+# words with an FAQ but need the AI.
+HELD_OUT = [
+    ("how much do you charge", True),
+    ("what does your service cost", True),
+    ("can i send the money by telebirr", True),
+    ("what background colour for the photo", True),
+    ("when does the dv lottery close this year", True),
+    ("must i include my wife", True),
+    ("የዲቪ ፎቶ መስፈርት", True),
+    ("how much is the visa interview fee", False),
+    ("how much does the embassy interview cost", False),
+    ("when is the interview", False),
+    ("is the interview free?", False),
+    ("how much does the medical exam cost", False),
+    ("what documents do I bring to the interview", False),
+    ("when will I get my visa", False),
+    ("can I pay the visa fee with telebirr", False),
+    ("how long is the green card valid", False),
+    ("what photo do I need for the passport", False),
+    ("do my children need a medical exam", False),
+    ("የቃለ መጠይቅ ክፍያ ስንት ነው", False),
+    ("ቪዛ መቼ ይወጣል", False),
+    ("የህክምና ምርመራ ስንት ብር ነው", False),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threshold", type=float, default=FAQ_THRESHOLD)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    index = FAQIndex.from_file()
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    def evaluate(samples):
+        hits = correct = false_positives = 0
+        for question, expected in samples:
+            _, score = index.search(question)
+            answered = index.lookup(question, args.threshold) is not None
+            hits += answered
+            correct += answered == expected
+            false_positives += answered and not expected
+            mark = "✅" if answered == expected else "❌"
+            print(f"{mark} {score:.2f} {'HIT ' if answered else 'MISS'} {question}")
+        return hits, correct, false_positives
+
+    hits, correct, false_positives = evaluate(SAMPLES)
+    print("\nHeld out:")
+    held_hits, held_correct, held_false_positives = evaluate(HELD_OUT)
+
+    timings = []
+    for _ in range(args.rounds):
+        for question, _expected in SAMPLES:
+            t = time.perf_counter()
+            index.lookup(question, args.threshold)
+            timings.append((time.perf_counter() - t) * 1e6)
+    timings.sort()
+
+    print()
+    print(f"Index rows:   {len(index.answers)} (built in {build_ms:.1f} ms)")
+    print(f"Hit rate:     {hits}/{len(SAMPLES)} ({hits / len(SAMPLES):.0%})")
+    print(f"Accuracy:     {correct}/{len(SAMPLES)}, {false_positives} false positives")
+    print(f"Held out:     {held_correct}/{len(HELD_OUT)} correct, {held_hits} hits, "
+          f"{held_false_positives} false positives")
+    print(f"Lookup p50:   {statistics.median(timings):.1f} µs")
+    print(f"Lookup p99:   {timings[int(len(timings) * 0.99)]:.1f} µs")
+    if false_positives or held_false_positives:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
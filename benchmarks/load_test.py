@@ -0,0 +1,287 @@
+"""
+Offline load test: N simulated applicants walk the whole DVFlow through the
+real Dispatcher (dp.feed_update) against a fake Bot API session. No network;
+Gemini is replaced by a stub model with configurable latency.
+
+    python benchmarks/load_test.py [--users 200] [--concurrency 50] [--ai-latency 1.5]
+
+Reports updates/s, p50/p95/p99 update latency (overall and per step),
+peak RSS and CPU time. Run it before and after storage or concurrency changes.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Everything the bot writes goes to a throwaway directory
+WORKDIR = tempfile.mkdtemp(prefix="dvbot-load-")
+os.environ.update({
+    "BOT_TOKEN": "123456:LOADTEST",
+    "ADMIN_ID": "1",
+    "STORAGE_PATH": os.path.join(WORKDIR, "fsm.sqlite3"),
+    "SUBMISSIONS_PATH": os.path.join(WORKDIR, "submissions.sqlite3"),
+    "DOSSIER_DIR": os.path.join(WORKDIR, "dossiers"),
+    "PHOTO_DIR": os.path.join(WORKDIR, "photos"),
+    "EXPORT_DIR": os.path.join(WORKDIR, "exports"),
+    "BROADCAST_DIR": os.path.join(WORKDIR, "broadcasts"),
+    "AI_MODEL_CACHE": os.path.join(WORKDIR, "model.json"),
+})
+os.environ.pop("AI_CACHE_FILE", None)
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import CallbackQuery, Chat, File, Message, PhotoSize, Update, User  # noqa: E402
+
+from texts import TRANS  # noqa: E402
+
+# Questions the FAQ index does not answer (bench_faq.py checks this kind), so they reach the (stub) model
+AI_QUESTIONS = [
+    "I was born in Kenya but live in Ethiopia, which country do I use?",
+    "my passport expired, can I still apply?",
+    "what is the education requirement",
+    "can my cousin apply for me?",
+]
+
+
+def test_photo():
+    # Passes the DV photo check: square, light background, centred subject
+    from PIL import Image, ImageDraw
+    img = Image.new("RGB", (600, 600), (245, 245, 245))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((180, 120, 420, 420), fill=(150, 110, 80))
+    draw.rectangle((120, 420, 480, 600), fill=(40, 40, 60))
+    buffer = BytesIO()
+    img.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class FakeSession(BaseSession):
+    """Bot API stand-in: every call succeeds after `latency` seconds."""
+
+    def __init__(self, latency, photo):
+        super().__init__()
+        self.latency = latency
+        self.photo = photo
+        self.calls = 0
+        self._ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        returns = method.__returning__
+        if returns is Message:
+            chat_id = getattr(method, "chat_id", 1)
+            return Message(message_id=next(self._ids), date=datetime.datetime.now(),
+                           chat=Chat(id=chat_id if isinstance(chat_id, int) else 1, type="private"),
+                           text="ok").as_(bot)
+        if returns is File:
+            return File(file_id=method.file_id, file_unique_id=method.file_id, file_path=f"photos/{method.file_id}.jpg")
+        if returns == list[Message]:
+            return []
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield self.photo
+
+    async def close(self):
+        pass
+
+
+class StubModel:
+    """Replaces the Gemini model object; answers after `latency` seconds."""
+
+    def __init__(self, latency, chunks=4):
+        self.latency = latency
+        self.chunks = chunks
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        if not stream:
+            await asyncio.sleep(self.latency)
+            return _Chunk("This is a stub answer about the DV lottery.")
+        return self._stream()
+
+    async def _stream(self):
+        for i in range(self.chunks):
+            await asyncio.sleep(self.latency / self.chunks)
+            yield _Chunk(f"Stub answer part {i + 1}. ")
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class Applicant:
+    """One simulated user. Each step is (label, update)."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, user_id, rng, ai_ratio):
+        self.user_id = user_id
+        self.rng = rng
+        self.lang = rng.choice(["en", "am"])
+        self.ai_ratio = ai_ratio
+        self.photos = itertools.count(1)
+
+    def t(self, key):
+        return TRANS[self.lang][key]
+
+    def _message(self, **kwargs):
+        chat = Chat(id=self.user_id, type="private")
+        user = User(id=self.user_id, is_bot=False, first_name="Load", username=f"load{self.user_id}")
+        message = Message(message_id=next(self.ids), date=datetime.datetime.now(), chat=chat, from_user=user, **kwargs)
+        return Update(update_id=next(self.ids), message=message)
+
+    def text(self, text):
+        return self._message(text=text)
+
+    def photo(self):
+        file_id = f"u{self.user_id}p{next(self.photos)}"
+        return self._message(photo=[PhotoSize(file_id=file_id, file_unique_id=file_id, width=600, height=600)])
+
+    def callback(self, data):
+        user = User(id=self.user_id, is_bot=False, first_name="Load")
+        message = Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=self.user_id, type="private"), text="menu")
+        query = CallbackQuery(id=str(next(self.ids)), from_user=user, chat_instance="load", data=data, message=message)
+        return Update(update_id=next(self.ids), callback_query=query)
+
+    def steps(self):
+        rng = self.rng
+        yield "start", self.text("/start")
+        yield "language", self.callback(f"lang_{self.lang}")
+        if rng.random() < self.ai_ratio:
+            yield "ai_question", self.text(rng.choice(AI_QUESTIONS))
+        yield "open_form", self.text(self.t("btn_start"))
+        yield "first_name", self.text(f"Abebe{self.user_id}")
+        yield "last_name", self.text("Kebede")
+        yield "gender", self.text(self.t(rng.choice(["male", "female"])))
+        married = rng.random() < 0.5
+        yield "marital", self.text(self.t("married" if married else "single"))
+        if married:
+            yield "spouse_name", self.text("Sara Tesfaye")
+            yield "photo", self.photo()
+        kids = rng.choice([0, 0, 1, 2, 3])
+        yield "has_children", self.text(self.t("yes" if kids else "no"))
+        if kids:
+            yield "child_count", self.text(str(kids))
+            for i in range(kids):
+                yield "child_name", self.text(f"Child {i + 1}")
+                yield "child_gender", self.text(self.t(rng.choice(["male", "female"])))
+                yield "photo", self.photo()
+        if rng.random() < self.ai_ratio:
+            yield "photo_step_question", self.text("Can I wear glasses in this photo, is that allowed?")
+        yield "photo", self.photo()
+        yield "review", self.text(self.t("btn_confirm"))
+        yield "payment", self.photo()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+
+async def run(args):
+    logging.disable(logging.INFO)
+    import ai_service
+    import bot as dvbot
+
+    session = FakeSession(args.api_latency / 1000, test_photo())
+    dvbot.bot.session = session
+    stub = StubModel(args.ai_latency)
+    ai_service.model = stub
+    dvbot.outbox.start()
+    # As on_startup does, so the first photos do not wait for the workers to spawn
+    await dvbot.start_pools()
+
+    rng = random.Random(args.seed)
+    latencies = {}   # step label -> [seconds]
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def applicant(user_id):
+        person = Applicant(user_id, random.Random(rng.random()), args.ai_ratio)
+        async with gate:
+            for label, update in person.steps():
+                started = time.perf_counter()
+                await dvbot.dp.feed_update(dvbot.bot, update)
+                latencies.setdefault(label, []).append(time.perf_counter() - started)
+                if args.think:
+                    await asyncio.sleep(rng.uniform(0, 2 * args.think / 1000))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(applicant(10_000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    # Dossiers render in the background after payment; include them in the run
+    if dvbot.background_tasks:
+        await asyncio.wait(dvbot.background_tasks, timeout=args.drain)
+    drained = time.perf_counter() - started
+
+    all_latencies = sorted(x for values in latencies.values() for x in values)
+    updates = len(all_latencies)
+    submitted = await dvbot.submissions.count()
+
+    print(f"Applicants:     {args.users} ({args.concurrency} at once), {submitted} reached payment")
+    print(f"Updates:        {updates} in {elapsed:.2f}s = {updates / elapsed:.0f} updates/s")
+    print(f"Latency p50:    {percentile(all_latencies, 0.50) * 1000:.1f} ms")
+    print(f"Latency p95:    {percentile(all_latencies, 0.95) * 1000:.1f} ms")
+    print(f"Latency p99:    {percentile(all_latencies, 0.99) * 1000:.1f} ms")
+    print(f"Bot API calls:  {session.calls}, stub AI calls: {stub.calls}")
+    print(f"Background:     dossiers done after {drained:.2f}s, outbox backlog {dvbot.outbox.queue.qsize()} jobs "
+          f"(admin chat is throttled to 1 msg/s)")
+    own, children = peak_rss_mb()
+    print(f"Peak RSS:       {own:.0f} MB (worker processes: {children:.0f} MB)")
+    cpu = os.times()
+    print(f"CPU time:       {cpu.user + cpu.system:.1f}s bot process, "
+          f"{cpu.children_user + cpu.children_system:.1f}s photo check / dossier workers (incl. imports)")
+    print()
+    print(f"{'step':<20} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, values in sorted(latencies.items(), key=lambda kv: -percentile(sorted(kv[1]), 0.95)):
+        values.sort()
+        print(f"{label:<20} {len(values):>6} {percentile(values, 0.5) * 1000:>8.1f} "
+              f"{percentile(values, 0.95) * 1000:>8.1f} {percentile(values, 0.99) * 1000:>8.1f}")
+
+    await dvbot.outbox.close(timeout=0)
+    dvbot.photo_check.close()
+    dvbot.dossier.close()
+    await dvbot.storage.close()
+    dvbot.submissions.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200, help="applicants in total")
+    parser.add_argument("--concurrency", type=int, default=50, help="applicants active at once")
+    parser.add_argument("--think", type=float, default=0, help="mean pause between a user's messages (ms)")
+    parser.add_argument("--api-latency", type=float, default=20, help="simulated Bot API latency (ms)")
+    parser.add_argument("--ai-latency", type=float, default=1.5, help="stub Gemini latency (s)")
+    parser.add_argument("--ai-ratio", type=float, default=0.2, help="share of users asking the AI a question")
+    parser.add_argument("--drain", type=float, default=120, help="max seconds to wait for background dossiers")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    print(f"Working files in {WORKDIR}")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
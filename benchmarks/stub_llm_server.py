@@ -0,0 +1,123 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions endpoint, for
+exercising ai_providers (deadlines, breaker, hedging, failover) without a
+real LLM.
+
+    python benchmarks/stub_llm_server.py --port 8081 --latency 0.8 --slow-rate 0.1
+
+then run the bot with AI_FALLBACK_BASE_URL=http://127.0.0.1:8081/v1.
+The behaviour can be changed while it runs:
+
+    curl -X POST localhost:8081/_config -d '{"error_rate": 1}'
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+DEFAULTS = {
+    'latency': 0.5,      # seconds before the first chunk
+    'chunk_delay': 0.05,
+    'chunks': 5,
+    'error_rate': 0.0,   # share of requests answered with HTTP 500
+    'slow_rate': 0.0,    # share of requests whose first chunk takes `slow_latency`
+    'slow_latency': 10.0,
+    'hang_rate': 0.0,    # share of requests that never answer
+}
+
+
+def make_app(**config):
+    app = web.Application()
+    app['config'] = {**DEFAULTS, **config}
+    app['stats'] = {'requests': 0, 'errors': 0, 'slow': 0, 'hung': 0}
+    app.router.add_post('/v1/chat/completions', completions)
+    app.router.add_post('/_config', set_config)
+    app.router.add_get('/_stats', get_stats)
+    return app
+
+
+async def set_config(request):
+    request.app['config'].update(await request.json())
+    return web.json_response(request.app['config'])
+
+
+async def get_stats(request):
+    return web.json_response(request.app['stats'])
+
+
+def _chunk(model, text=None, finish=None):
+    return {
+        'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+        'choices': [{'index': 0, 'delta': {'content': text} if text else {}, 'finish_reason': finish}],
+    }
+
+
+async def completions(request):
+    config, stats = request.app['config'], request.app['stats']
+    body = await request.json()
+    model = body.get('model', 'stub')
+    stats['requests'] += 1
+
+    roll = random.random()
+    if roll < config['error_rate']:
+        stats['errors'] += 1
+        return web.json_response({'error': {'message': 'stub failure', 'type': 'server_error'}}, status=500)
+    roll -= config['error_rate']
+    if roll < config['hang_rate']:
+        stats['hung'] += 1
+        await asyncio.sleep(3600)
+    roll -= config['hang_rate']
+    delay = config['latency']
+    if roll < config['slow_rate']:
+        stats['slow'] += 1
+        delay = config['slow_latency']
+    await asyncio.sleep(delay)
+
+    question = body['messages'][-1]['content']
+    words = [f"Stub answer to '{question[:40]}'"] + [f" part {i + 1}." for i in range(config['chunks'] - 1)]
+
+    if not body.get('stream'):
+        return web.json_response({
+            'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(words)}, 'finish_reason': 'stop'}],
+        })
+
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+    try:
+        await response.prepare(request)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(config['chunk_delay'])
+            await response.write(f"data: {json.dumps(_chunk(model, word))}\n\n".encode())
+        await response.write(f"data: {json.dumps(_chunk(model, finish='stop'))}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+    except ConnectionResetError:
+        pass   # the client gave up on this answer (timeout or lost hedge)
+    return response
+
+
+async def start(app, port=0, host='127.0.0.1'):
+    """Serve `app` in the running loop; returns (runner, base_url). Port 0 picks a free port."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    for key, value in DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = vars(parser.parse_args())
+    port = args.pop('port')
+    print(f"🧪 Stub LLM on http://127.0.0.1:{port}/v1")
+    web.run_app(make_app(**args), host='127.0.0.1', port=port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,35 @@
+import time
+BOOT_STARTED = time.perf_counter()
+
 import asyncio
 import logging
 import os
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from ai_service import ask_gemini
-from keep_alive import start_server
-
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
+from ai_service import ask_gemini, backend, cache_stats, connect_model, conversations, scheduler, stream_gemini, save_cache
+from broadcast import Broadcaster
+from chat_queue import SequencedDispatcher
+from delivery import Outbox, photo_album_calls
+import dossier
+from dossier import build_dossier
+from faq import answer_locally
+from filters import Magic
+from form import DVFlow, form_engine, get_text
+import photo_check
+from photo_store import PhotoStore, submission_photos
+from keep_alive import build_app, start_server
+import metrics
+from metrics import HandlerMetricsMiddleware, RequestMetricsMiddleware, UpdateMetricsMiddleware
+from ratelimit import TokenBucket
+from storage import SQLiteStorage, FlushMiddleware
+from submissions import APPROVED, PENDING, SubmissionStore
+from session import FormSession, FormSessionMiddleware
+
+from aiogram import Bot, types, F
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.types import Message, CallbackQuery, FSInputFile, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
 from texts import TRANS
 
@@ -18,56 +38,252 @@ load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = os.getenv("ADMIN_ID")
 
+# Webhook mode is used when WEBHOOK_URL is set (e.g. https://dvbot.onrender.com), polling otherwise
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+HANDLER_CONCURRENCY = int(os.getenv("HANDLER_CONCURRENCY", 100))
+
+# Telegram allows roughly one edit per second per chat before flood limits kick in
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.5))
+
+# Stray text in a photo step gets at most one AI answer per user per this many seconds
+PHOTO_HELP_AI_INTERVAL = float(os.getenv("PHOTO_HELP_AI_INTERVAL", 300))
+
 if not TOKEN:
     print("Error: BOT_TOKEN not found!")
     exit()
 
 logging.basicConfig(level=logging.INFO)
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
-
-# 2. STATES
-class DVFlow(StatesGroup):
-    choosing_lang = State()
-    main_menu = State()
-    first_name = State()
-    last_name = State()
-    gender = State()
-    marital_status = State()
-    spouse_name = State()
-    spouse_gender = State()
-    spouse_photo = State()
-    has_children = State()
-    children_count = State()
-    child_name = State()
-    child_gender = State()
-    child_photo = State()
-    main_photo = State()
-    review_info = State()
-    payment_upload = State()
-
-# HELPER
-def get_text(data, key):
-    lang = data.get('lang', 'en') 
-    return TRANS[lang].get(key, "Text Missing")
+storage = SQLiteStorage(
+    path=os.getenv("STORAGE_PATH", "dvbot.sqlite3"),
+    idle_ttl=int(os.getenv("SESSION_IDLE_TTL", 1800)),
+)
+# Different chats run in parallel, each chat's updates strictly in order
+dp = SequencedDispatcher(storage=storage, max_chats=HANDLER_CONCURRENCY)
+outbox = Outbox(shared_chats=[ADMIN_ID] if ADMIN_ID else ())
+submissions = SubmissionStore(os.getenv("SUBMISSIONS_PATH", "submissions.sqlite3"))
+broadcasts = Broadcaster(bot, storage.path, submissions.path, global_bucket=outbox.global_bucket)
+photo_archive = PhotoStore(bot)
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+dp.update.outer_middleware(FlushMiddleware(storage))
+# Registered before FormSessionMiddleware so it sees the state each handler moved to
+handler_metrics = HandlerMetricsMiddleware()
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+dp.message.middleware(FormSessionMiddleware())
+dp.callback_query.middleware(FormSessionMiddleware())
+bot.session.middleware(RequestMetricsMiddleware())
+dp.shutdown.register(save_cache)
+dp.shutdown.register(broadcasts.close)
+dp.shutdown.register(outbox.close)
+dp.shutdown.register(photo_check.close)
+dp.shutdown.register(dossier.close)
+dp.shutdown.register(submissions.close)
+dp.shutdown.register(photo_archive.close)
+
+# --- METRICS ---
+metrics.registry.gauge("dvbot_funnel_users", lambda: storage.state_counts, label='state')
+metrics.registry.gauge("dvbot_chat_queue", dp.sequencer.snapshot, label='stat',
+                       help="Per-chat update queues (updates waiting or running)")
+metrics.registry.gauge("dvbot_ai_scheduler", scheduler.snapshot, label='stat', help="AI admission queue")
+metrics.registry.gauge("dvbot_ai_backend", lambda: backend.stats, label='stat', help="Hedges, failovers and unavailable answers")
+metrics.registry.gauge("dvbot_ai_memory", lambda: {'users': len(conversations), **conversations.stats}, label='stat',
+                       help="Per-user AI conversation memory")
+metrics.registry.gauge("dvbot_ai_breaker_open", lambda: {name: int(state != 'closed') for name, state in backend.breaker_states().items()},
+                       label='provider', help="1 while a provider's circuit breaker is open or half-open")
+metrics.registry.gauge("dvbot_ai_cache", lambda: cache_stats, label='stat', help="AI answer cache hits and misses")
+metrics.registry.gauge("dvbot_photo_check", lambda: photo_check.stats, label='stat', help="DV photo checks run, cached and failed")
+metrics.registry.gauge("dvbot_dossier", lambda: dossier.stats, label='stat', help="Dossier PDFs rendered and served from cache")
+metrics.registry.gauge("dvbot_outbox_queue", outbox.queue.qsize, help="Outbound jobs waiting for a worker")
+metrics.registry.gauge("dvbot_outbox", lambda: outbox.stats, label='stat', help="Outbound delivery counters")
+metrics.registry.gauge("dvbot_storage", storage.snapshot, label='stat', help="FSM sessions held in RAM")
+metrics.registry.gauge("dvbot_photo_store", photo_archive.snapshot, label='stat', help="Local photo cache downloads and hits")
+metrics.registry.gauge("dvbot_broadcast", broadcasts.snapshot, label='stat', help="Broadcasts running in this process")
+
+# STARTUP TIMING
+startup_report = {'setup_ms': (time.perf_counter() - BOOT_STARTED) * 1000}
+background_tasks = set()
+
+async def start_pools():
+    # Worker processes take a second or more to spawn and import; start them before the first applicant needs one
+    pools = [dossier.pool] + ([photo_check.pool] if photo_check.PHOTO_CHECK_MODE != 'off' else [])
+    await asyncio.gather(*(pool.start() for pool in pools))
+
+@dp.startup()
+async def on_startup():
+    # Model discovery and pool warm-up run in the background; AI replies report "not connected" until it finishes
+    for job in (connect_model(), start_pools()):
+        task = asyncio.create_task(job)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    # Broadcasts interrupted by a restart carry on from their checkpoint
+    if broadcasts.resume():
+        print("📣 Resumed unfinished broadcasts")
+    startup_report['ready_ms'] = (time.perf_counter() - BOOT_STARTED) * 1000
+    print(f"⏱️ Startup: imports+setup {startup_report['setup_ms']:.0f} ms, ready {startup_report['ready_ms']:.0f} ms")
+
+@dp.update.outer_middleware()
+async def first_update_timer(handler, event, data):
+    if 'first_update_seen' in startup_report:
+        return await handler(event, data)
+    # Updates for other chats run concurrently; only the first one reports
+    startup_report['first_update_seen'] = True
+    result = await handler(event, data)
+    startup_report['first_update_ms'] = (time.perf_counter() - BOOT_STARTED) * 1000
+    print(f"⏱️ First update served {startup_report['first_update_ms']:.0f} ms after start")
+    return result
 
 # --- HANDLERS ---
 
 @dp.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, session: FormSession):
     kb = [[InlineKeyboardButton(text="English 🇺🇸", callback_data="lang_en"),
            InlineKeyboardButton(text="አማርኛ 🇪🇹", callback_data="lang_am")]]
     await message.answer(TRANS['en']['welcome'] + "\n\n" + TRANS['am']['welcome'], reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
-    await state.set_state(DVFlow.choosing_lang)
+    session.set_state(DVFlow.choosing_lang)
+
+# --- ADMIN ---
+PAGE_SIZE = 10
+
+async def is_admin(event: Message | CallbackQuery):
+    return ADMIN_ID is not None and str(event.from_user.id) == str(ADMIN_ID)
+
+def format_submission(row):
+    when = time.strftime('%Y-%m-%d %H:%M', time.localtime(row['submitted_at']))
+    return f"#{row['id']} {row['first_name']} {row['last_name']} (@{row['username']}, {row['user_id']}) {when} [{row['status']}]"
+
+@dp.message(Command("pending"), is_admin)
+async def admin_pending(message: Message, command: CommandObject):
+    page = int(command.args) if command.args and command.args.isdigit() else 1
+    total = await submissions.count(PENDING)
+    rows = await submissions.list_by_status(PENDING, limit=PAGE_SIZE, offset=(page - 1) * PAGE_SIZE)
+    if not rows:
+        await message.answer(f"No pending applications on page {page} ({total} pending).")
+        return
+    pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+    lines = [f"🗂 Pending: {total} (page {page}/{pages})", ""] + [format_submission(r) for r in rows]
+    if page < pages:
+        lines.append(f"\nNext: /pending {page + 1}")
+    await message.answer("\n".join(lines))
+
+@dp.message(Command("approve_batch"), is_admin)
+async def admin_approve_batch(message: Message, command: CommandObject):
+    if not command.args or not command.args.isdigit():
+        await message.answer("Usage: /approve_batch N (approves the N oldest pending applications)")
+        return
+    approved = await submissions.approve_oldest(int(command.args))
+    notify_approved(approved)
+    await message.answer(f"✅ Approved {len(approved)}. Notifications are being sent.")
+
+@dp.message(Command("lookup"), is_admin)
+async def admin_lookup(message: Message, command: CommandObject):
+    arg = (command.args or "").strip()
+    if arg.startswith("@"):
+        rows = await submissions.by_user(username=arg[1:])
+    elif arg.isdigit():
+        rows = await submissions.by_user(user_id=int(arg))
+    else:
+        await message.answer("Usage: /lookup <user id> or /lookup @username")
+        return
+    await message.answer("\n".join(format_submission(r) for r in rows) if rows else "No submissions found.")
+
+BROADCAST_OPTIONS = ('lang', 'state', 'status')
+STATE_NAMES = {name.rpartition(':')[2] for name in DVFlow.__all_states_names__}
+
+def parse_broadcast_args(args):
+    # Options go on the first line ("lang=am state=main_menu,first_name"), the text below it
+    first, _, rest = args.partition("\n")
+    words = first.split()
+    if words and all("=" in w and w.partition("=")[0] in BROADCAST_OPTIONS for w in words):
+        return dict(w.split("=", 1) for w in words), rest.strip()
+    return {}, args.strip()
+
+@dp.message(Command("broadcast"), is_admin)
+async def admin_broadcast(message: Message, command: CommandObject):
+    options, text = parse_broadcast_args(command.args or "")
+    states = set(options['state'].split(",")) if 'state' in options else None
+    if (not text or options.get('lang', 'en') not in TRANS or (states and not states <= STATE_NAMES)
+            or options.get('status', PENDING) not in (PENDING, APPROVED) or (states and 'status' in options)):
+        await message.answer(
+            "Usage: /broadcast [lang=en|am] [state=main_menu,...] [status=pending|approved]\n<message text>\n\n"
+            "state= targets users at those form steps, status= targets submitted applications; "
+            "use one or the other, not both.")
+        return
+    b = await broadcasts.create(text, lang=options.get('lang'), states=states, status=options.get('status'))
+    await message.answer(f"📣 Broadcast {b.id} started to {b.total} chats.\n"
+                         f"Progress: /broadcast_status {b.id}\nStop: /broadcast_stop {b.id}")
+
+@dp.message(Command("broadcast_status"), is_admin)
+async def admin_broadcast_status(message: Message, command: CommandObject):
+    b = broadcasts.status(command.args.strip() if command.args else None)
+    await message.answer(b.summary() if b else "No broadcasts found.")
+
+@dp.message(Command("broadcast_stop"), is_admin)
+async def admin_broadcast_stop(message: Message, command: CommandObject):
+    if not command.args:
+        await message.answer("Usage: /broadcast_stop <id>")
+        return
+    stopped = broadcasts.cancel(command.args.strip())
+    await message.answer("🛑 Stopping (within a few seconds)." if stopped else "No such broadcast.")
+
+# Telegram bots may send documents up to 50 MB
+EXPORT_SEND_LIMIT = 49 * 1024 * 1024
+
+@dp.message(Command("export"), is_admin)
+async def admin_export(message: Message, command: CommandObject):
+    arg = (command.args or "").split()
+    if arg and all(part.isdigit() for part in arg[0].split(",")):
+        query = {'ids': [int(part) for part in arg[0].split(",")]}
+    elif arg and arg[0] in (PENDING, APPROVED, 'all'):
+        limit = int(arg[1]) if len(arg) > 1 and arg[1].isdigit() else None
+        query = {'status': None if arg[0] == 'all' else arg[0], 'limit': limit}
+    else:
+        await message.answer("Usage: /export pending|approved|all [N] or /export 12,15,20")
+        return
+    rows = await submissions.for_export(**query)
+    if not rows:
+        await message.answer("No submissions match.")
+        return
+    await message.answer(f"📦 Exporting {len(rows)} submissions...")
+    # Photos not cached yet are downloaded first; don't hold up this chat meanwhile
+    task = asyncio.create_task(send_export(message.chat.id, rows))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def send_export(chat_id, rows):
+    try:
+        path, summary = await photo_archive.export(rows)
+    except Exception as e:
+        logging.warning(f"Export failed: {e}")
+        outbox.submit(chat_id, [lambda: bot.send_message(chat_id, f"❌ Export failed: {e}")])
+        return
+    size = os.path.getsize(path)
+    text = (f"📦 {summary['submissions']} submissions, {summary['photos']} photos "
+            f"({size / 1e6:.1f} MB) in {summary['seconds']}s")
+    if summary['missing']:
+        text += f", {summary['missing']} photos could not be fetched"
+    if size <= EXPORT_SEND_LIMIT:
+        calls = [lambda: bot.send_document(chat_id, FSInputFile(path), caption=text)]
+    else:
+        calls = [lambda: bot.send_message(chat_id, f"{text}\nToo large for Telegram, saved on the server: {path}")]
+    outbox.submit(chat_id, calls)
 
-@dp.callback_query(F.data.startswith("lang_"))
-async def language_selected(callback: CallbackQuery, state: FSMContext):
+def report_broadcast(b):
+    if ADMIN_ID:
+        outbox.submit(ADMIN_ID, [lambda: bot.send_message(ADMIN_ID, b.summary())])
+
+broadcasts.notify = report_broadcast
+
+@dp.callback_query(Magic(F.data.startswith("lang_")))
+async def language_selected(callback: CallbackQuery, session: FormSession):
     selected_lang = callback.data.split("_")[1]
-    await state.update_data(lang=selected_lang, children=[]) 
-    data = await state.get_data()
+    session.update(lang=selected_lang, children=[])
+    data = session.data
     await callback.message.answer(get_text(data, 'lang_set'))
     await show_main_menu(callback.message, data)
-    await state.set_state(DVFlow.main_menu)
+    session.set_state(DVFlow.main_menu)
     await callback.answer()
 
 async def show_main_menu(message: Message, data):
@@ -76,280 +292,123 @@ async def show_main_menu(message: Message, data):
     await message.answer(get_text(data, 'main_menu'), reply_markup=ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True))
 
 # --- BUTTONS HANDLERS ---
-@dp.message(F.text.in_([TRANS['en']['btn_start'], TRANS['am']['btn_start']]))
-async def start_app(message: Message, state: FSMContext):
-    data = await state.get_data()
-    await message.answer(get_text(data, 'ask_firstname'), reply_markup=ReplyKeyboardRemove())
-    await state.set_state(DVFlow.first_name)
-
-@dp.message(F.text.in_([TRANS['en']['btn_price'], TRANS['am']['btn_price']]))
-async def show_price(message: Message, state: FSMContext):
-    data = await state.get_data()
+@dp.message(Magic(F.text.in_([TRANS['en']['btn_start'], TRANS['am']['btn_start']])))
+async def start_app(message: Message, session: FormSession):
+    await form_engine.enter(message, session, DVFlow.first_name)
+
+@dp.message(Magic(F.text.in_([TRANS['en']['btn_price'], TRANS['am']['btn_price']])))
+async def show_price(message: Message, session: FormSession):
+    data = session.data
     await message.answer(get_text(data, 'price_info'))
 
-@dp.message(F.text.in_([TRANS['en']['btn_help'], TRANS['am']['btn_help']]))
-async def ai_help_mode(message: Message, state: FSMContext):
-    data = await state.get_data()
+@dp.message(Magic(F.text.in_([TRANS['en']['btn_help'], TRANS['am']['btn_help']])))
+async def ai_help_mode(message: Message, session: FormSession):
+    data = session.data
     prompt_msg = "🤖 **AI Assistant**\n\nAsk me anything about DV-2027.\n(Type your question below)"
     if data.get('lang') == 'am':
         prompt_msg = "🤖 **AI ረዳት**\n\nስለ DV-2027 ማንኛውንም ጥያቄ ይጠይቁ።\n(ጥያቄዎን ከታች ይጻፉ)"
     await message.answer(prompt_msg)
 
 # --- GENERAL AI HANDLER ---
-@dp.message(DVFlow.main_menu, F.text)
-async def general_ai_chat(message: Message, state: FSMContext):
-    await bot.send_chat_action(chat_id=message.chat.id, action="typing")
-    ai_response = await ask_gemini(message.text)
-    await message.answer(ai_response)
-
-# --- FORM FLOW WITH VALIDATION ---
-
-@dp.message(DVFlow.first_name)
-async def get_fname(message: Message, state: FSMContext):
-    # Basic validation: ensure it's text and not too short
-    if len(message.text) < 2:
-        await message.answer("⚠️ Name too short. Please enter valid name.")
+@dp.message(StateFilter(DVFlow.main_menu), Magic(F.text))
+async def general_ai_chat(message: Message):
+    # Common questions are answered from the local FAQ index, no LLM call
+    local_answer = answer_locally(message.text)
+    if local_answer:
+        # Kept as context, so a follow-up to an FAQ answer still makes sense to the AI
+        conversations.add(message.from_user.id, message.text, local_answer)
+        await message.answer(local_answer)
         return
-    await state.update_data(first_name=message.text)
-    data = await state.get_data()
-    await message.answer(get_text(data, 'ask_lastname'))
-    await state.set_state(DVFlow.last_name)
-
-@dp.message(DVFlow.last_name)
-async def get_lname(message: Message, state: FSMContext):
-    await state.update_data(last_name=message.text)
-    data = await state.get_data()
-    kb = [[KeyboardButton(text=get_text(data, 'male')), KeyboardButton(text=get_text(data, 'female'))]]
-    await message.answer(get_text(data, 'ask_gender'), reply_markup=ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True))
-    await state.set_state(DVFlow.gender)
-
-# --- GENDER VALIDATION ---
-@dp.message(DVFlow.gender)
-async def get_gender(message: Message, state: FSMContext):
-    data = await state.get_data()
-    text = message.text
-    
-    # Valid options
-    valid_options = [TRANS['en']['male'], TRANS['en']['female'], TRANS['am']['male'], TRANS['am']['female']]
-    
-    if text not in valid_options:
-        await message.answer("⚠️ Please select one of the buttons below:", reply_markup=ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text=get_text(data, 'male')), KeyboardButton(text=get_text(data, 'female'))]], 
-            resize_keyboard=True))
-        return # STOP HERE. Don't change state.
 
-    await state.update_data(gender=text)
-    
-    # Next Step
-    kb = [[KeyboardButton(text=get_text(data, 'single')), KeyboardButton(text=get_text(data, 'married'))],
-          [KeyboardButton(text=get_text(data, 'divorced')), KeyboardButton(text=get_text(data, 'widowed'))]]
-    await message.answer(get_text(data, 'ask_marital'), reply_markup=ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True))
-    await state.set_state(DVFlow.marital_status)
-
-# --- MARITAL VALIDATION ---
-@dp.message(DVFlow.marital_status)
-async def process_marital(message: Message, state: FSMContext):
-    data = await state.get_data()
-    text = message.text
-    
-    # Construct valid list
-    valid_list = [
-        get_text(data, 'single'), get_text(data, 'married'),
-        get_text(data, 'divorced'), get_text(data, 'widowed')
-    ]
-    # Also allow 'am' versions if user is in 'en' mode but clicks 'am' (edge case, but safe)
-    valid_list += [TRANS['am']['single'], TRANS['am']['married'], TRANS['en']['single'], TRANS['en']['married']]
-    
-    if text not in valid_list and text not in [TRANS['en']['divorced'], TRANS['en']['widowed'], TRANS['am']['divorced'], TRANS['am']['widowed']]:
-         # Re-send buttons
-        kb = [[KeyboardButton(text=get_text(data, 'single')), KeyboardButton(text=get_text(data, 'married'))],
-              [KeyboardButton(text=get_text(data, 'divorced')), KeyboardButton(text=get_text(data, 'widowed'))]]
-        await message.answer("⚠️ Invalid option. Please use the buttons:", reply_markup=ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True))
-        return # STOP HERE
-
-    await state.update_data(marital_status=text)
-    
-    if text == get_text(data, 'married'):
-        await message.answer(get_text(data, 'ask_spouse_name'), reply_markup=ReplyKeyboardRemove())
-        await state.set_state(DVFlow.spouse_name)
-    else:
-        await ask_about_children(message, state)
-
-# SPOUSE FLOW
-@dp.message(DVFlow.spouse_name)
-async def spouse_name(message: Message, state: FSMContext):
-    await state.update_data(spouse_name=message.text)
-    data = await state.get_data()
-    main_gender = data.get('gender')
-    
-    spouse_sex = "Unknown"
-    if main_gender == TRANS['en']['male']: spouse_sex = TRANS['en']['female']
-    elif main_gender == TRANS['en']['female']: spouse_sex = TRANS['en']['male']
-    elif main_gender == TRANS['am']['male']: spouse_sex = TRANS['am']['female']
-    elif main_gender == TRANS['am']['female']: spouse_sex = TRANS['am']['male']
-    
-    await state.update_data(spouse_gender=spouse_sex)
-    await message.answer(get_text(data, 'ask_spouse_photo'), reply_markup=ReplyKeyboardRemove())
-    await state.set_state(DVFlow.spouse_photo)
-
-# CHILDREN START
-async def ask_about_children(message: Message, state: FSMContext):
-    data = await state.get_data()
-    kb = [[KeyboardButton(text=get_text(data, 'yes')), KeyboardButton(text=get_text(data, 'no'))]]
-    await message.answer(get_text(data, 'ask_has_children'), reply_markup=ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True))
-    await state.set_state(DVFlow.has_children)
-
-# --- CHILDREN YES/NO VALIDATION ---
-@dp.message(DVFlow.has_children)
-async def process_has_children(message: Message, state: FSMContext):
-    data = await state.get_data()
-    text = message.text
-    
-    valid_yes = [TRANS['en']['yes'], TRANS['am']['yes']]
-    valid_no = [TRANS['en']['no'], TRANS['am']['no']]
-    
-    if text not in valid_yes and text not in valid_no:
-        kb = [[KeyboardButton(text=get_text(data, 'yes')), KeyboardButton(text=get_text(data, 'no'))]]
-        await message.answer("⚠️ Please select Yes or No:", reply_markup=ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True))
-        return # STOP HERE
-
-    if text in valid_yes:
-        await message.answer(get_text(data, 'ask_child_count'), reply_markup=ReplyKeyboardRemove())
-        await state.set_state(DVFlow.children_count)
-    else:
-        await ask_main_photo(message, state)
-
-# CHILDREN COUNT
-@dp.message(DVFlow.children_count)
-async def process_child_count(message: Message, state: FSMContext):
+    await bot.send_chat_action(chat_id=message.chat.id, action="typing")
+    await stream_reply(message, stream_gemini(message.text, user_id=message.from_user.id, remember=True))
+
+async def stream_reply(message: Message, chunks):
+    # Send the first chunk right away, then keep editing the same message at a throttled pace
+    started = time.perf_counter()
+    first_token = None
+    reply = None
+    text = shown = ""
+    last_edit = 0.0
+
+    async for chunk in chunks:
+        text += chunk
+        now = time.perf_counter()
+        if reply is None:
+            first_token = now - started
+            reply = await message.answer(text)
+            shown, last_edit = text, now
+        elif now - last_edit >= STREAM_EDIT_INTERVAL:
+            if await safe_edit(reply, text):
+                shown = text
+            last_edit = now
+
+    if reply is not None and text != shown:
+        await safe_edit(reply, text, final=True)
+
+    if first_token is not None:
+        logging.info(f"AI reply: first token {first_token:.2f}s, total {time.perf_counter() - started:.2f}s")
+
+async def safe_edit(reply: Message, text, final=False):
     try:
-        count = int(message.text)
-        if count < 1 or count > 20:
-             await message.answer("Please enter a realistic number (1-20).")
-             return
-             
-        await state.update_data(total_children=count, current_child_index=1, children=[])
-        data = await state.get_data()
-        msg = get_text(data, 'ask_child_name').format(n=1)
-        await message.answer(msg)
-        await state.set_state(DVFlow.child_name)
-    except ValueError:
-        await message.answer("Please enter a number (e.g., 1, 2).")
-
-# CHILD LOOP
-@dp.message(DVFlow.child_name)
-async def child_name_handler(message: Message, state: FSMContext):
-    await state.update_data(temp_child_name=message.text)
-    data = await state.get_data()
-    idx = data.get('current_child_index')
-    kb = [[KeyboardButton(text=get_text(data, 'male')), KeyboardButton(text=get_text(data, 'female'))]]
-    msg = get_text(data, 'ask_child_gender').format(n=idx)
-    await message.answer(msg, reply_markup=ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True))
-    await state.set_state(DVFlow.child_gender)
-
-# CHILD GENDER VALIDATION
-@dp.message(DVFlow.child_gender)
-async def child_gender_handler(message: Message, state: FSMContext):
-    data = await state.get_data()
-    text = message.text
-    valid_options = [TRANS['en']['male'], TRANS['en']['female'], TRANS['am']['male'], TRANS['am']['female']]
-    
-    if text not in valid_options:
-        idx = data.get('current_child_index')
-        kb = [[KeyboardButton(text=get_text(data, 'male')), KeyboardButton(text=get_text(data, 'female'))]]
-        await message.answer("⚠️ Please select Male or Female.", reply_markup=ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True))
-        return # STOP HERE
-
-    await state.update_data(temp_child_gender=message.text)
-    idx = data.get('current_child_index')
-    msg = get_text(data, 'ask_child_photo').format(n=idx)
-    await message.answer(msg, reply_markup=ReplyKeyboardRemove())
-    await state.set_state(DVFlow.child_photo)
-
-@dp.message(DVFlow.child_photo, F.photo)
-async def child_photo_handler(message: Message, state: FSMContext):
-    data = await state.get_data()
-    children_list = data.get('children', [])
-    new_child = {
-        'name': data.get('temp_child_name'),
-        'gender': data.get('temp_child_gender'),
-        'photo_id': message.photo[-1].file_id
-    }
-    children_list.append(new_child)
-    await state.update_data(children=children_list)
-    
-    current = data.get('current_child_index')
-    total = data.get('total_children')
-    
-    if current < total:
-        next_idx = current + 1
-        await state.update_data(current_child_index=next_idx)
-        msg = get_text(data, 'ask_child_name').format(n=next_idx)
-        await message.answer(msg)
-        await state.set_state(DVFlow.child_name)
-    else:
-        await ask_main_photo(message, state)
+        await reply.edit_text(text)
+        return True
+    except TelegramRetryAfter as e:
+        # Intermediate edits are just skipped; the final one must land
+        if not final:
+            return False
+        await asyncio.sleep(e.retry_after)
+        return await safe_edit(reply, text, final=True)
+    except TelegramBadRequest:
+        # "message is not modified" and similar
+        return False
+
+# --- FORM FLOW WITH VALIDATION ---
+# Steps, validators and keyboards are defined in form.py
 
 # SMART ERROR (PHOTO VALIDATION)
-@dp.message(DVFlow.spouse_photo, F.text)
-@dp.message(DVFlow.child_photo, F.text)
-@dp.message(DVFlow.main_photo, F.text) 
-@dp.message(DVFlow.payment_upload, F.text)
-async def smart_photo_error(message: Message, state: FSMContext):
+PHOTO_REMINDERS = {
+    DVFlow.spouse_photo.state: 'need_photo_spouse',
+    DVFlow.child_photo.state: 'need_photo_child',
+    DVFlow.main_photo.state: 'need_photo_main',
+    DVFlow.payment_upload.state: 'need_photo_payment',
+}
+photo_help_buckets = TTLCache(maxsize=50_000, ttl=PHOTO_HELP_AI_INTERVAL)
+
+def looks_like_question(text):
+    # Short replies ("ok", "wait", "here") just need the reminder
+    return '?' in text or '፧' in text or len(text.split()) >= 6
+
+def may_ask_ai(user_id):
+    bucket = photo_help_buckets.get(user_id)
+    if bucket is None:
+        bucket = photo_help_buckets[user_id] = TokenBucket(1 / PHOTO_HELP_AI_INTERVAL, 1)
+    return bucket.try_take()
+
+@dp.message(StateFilter(*PHOTO_REMINDERS), Magic(F.text))
+async def smart_photo_error(message: Message, session: FormSession):
+    data = session.data
+    reminder = get_text(data, PHOTO_REMINDERS[session.state]).format(n=data.get('current_child_index'))
     user_text = message.text
+
+    # Nearly always the answer is just "please upload a photo" - only real questions go to the AI
+    if not (looks_like_question(user_text) and may_ask_ai(message.from_user.id)):
+        await message.answer(reminder)
+        return
+
     await bot.send_chat_action(chat_id=message.chat.id, action="typing")
     context_prompt = (
         f"The user is in a form flow. They MUST upload a photo (image). "
         f"Instead, they typed: '{user_text}'. "
-        f"Explain politely in the appropriate language that they must upload an image file to proceed."
-    )
-    ai_response = await ask_gemini(context_prompt)
-    await message.answer(ai_response)
-
-# MAIN PHOTO
-async def ask_main_photo(message: Message, state: FSMContext):
-    data = await state.get_data()
-    await message.answer(get_text(data, 'ask_main_photo'), reply_markup=ReplyKeyboardRemove())
-    await state.set_state(DVFlow.main_photo)
-
-@dp.message(DVFlow.main_photo, F.photo)
-async def process_main_photo(message: Message, state: FSMContext):
-    await state.update_data(main_photo_id=message.photo[-1].file_id)
-    data = await state.get_data()
-    
-    spouse_txt = f"\n💍 Spouse: {data.get('spouse_name')}" if data.get('spouse_name') else ""
-    child_txt = ""
-    if data.get('children'):
-        for i, child in enumerate(data['children']):
-            child_txt += f"\n👶 Child {i+1}: {child['name']} ({child['gender']})"
-            
-    summary = (
-        f"{get_text(data, 'review_title')}\n\n"
-        f"👤 Name: {data.get('first_name')} {data.get('last_name')}\n"
-        f"⚧ Gender: {data.get('gender')}\n"
-        f"❤️ Status: {data.get('marital_status')}"
-        f"{spouse_txt}"
-        f"{child_txt}\n\n"
-        f"📸 Main Photo: [Received]"
+        f"Answer their question briefly in the same language they used."
     )
-    kb = [[KeyboardButton(text=get_text(data, 'btn_confirm'))], [KeyboardButton(text=get_text(data, 'btn_edit'))]]
-    await message.answer(summary, reply_markup=ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True))
-    await state.set_state(DVFlow.review_info)
-
-# REVIEW & PAYMENT
-@dp.message(DVFlow.review_info)
-async def process_review(message: Message, state: FSMContext):
-    data = await state.get_data()
-    if message.text == get_text(data, 'btn_edit'):
-        await message.answer(get_text(data, 'ask_firstname'), reply_markup=ReplyKeyboardRemove())
-        await state.set_state(DVFlow.first_name)
-    else:
-        await message.answer(get_text(data, 'payment_msg'), reply_markup=ReplyKeyboardRemove())
-        await state.set_state(DVFlow.payment_upload)
+    ai_response = await ask_gemini(context_prompt, user_id=message.from_user.id)
+    await message.answer(f"{ai_response}\n\n{reminder}")
 
-@dp.message(DVFlow.payment_upload, F.photo)
-async def process_payment(message: Message, state: FSMContext):
-    data = await state.get_data()
+# PAYMENT
+@dp.message(StateFilter(DVFlow.payment_upload), Magic(F.photo))
+async def process_payment(message: Message, session: FormSession):
+    data = session.data
     pay_id = message.photo[-1].file_id
     user = message.from_user
     
@@ -363,34 +422,104 @@ async def process_payment(message: Message, state: FSMContext):
         caption += f"💍 **Spouse:** {data.get('spouse_name')} ({data.get('spouse_gender')})\n"
     if data.get('children'):
         caption += f"👶 **Children:** {len(data['children'])} kids.\n"
+    if data.get('photo_issues'):
+        flagged = ", ".join(f"{label} ({', '.join(i.replace('photo_', '') for i in issues)})"
+                            for label, issues in data['photo_issues'].items())
+        caption += f"⚠️ **Photo check:** {flagged}\n"
 
-    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Approve", callback_data=f"approve_{user.id}")]])
-    
-    await bot.send_photo(chat_id=ADMIN_ID, photo=pay_id, caption=caption, reply_markup=kb)
-    await bot.send_photo(chat_id=ADMIN_ID, photo=data.get('main_photo_id'), caption=f"📸 Main Photo: {data.get('first_name')}")
-    if data.get('spouse_photo_id'):
-        await bot.send_photo(chat_id=ADMIN_ID, photo=data.get('spouse_photo_id'), caption="📸 Spouse Photo")
-    if data.get('children'):
-        for i, child in enumerate(data['children']):
-            await bot.send_photo(chat_id=ADMIN_ID, photo=child['photo_id'], caption=f"📸 Child {i+1}: {child['name']}")
-            
+    submission_id = await submissions.add(user.id, user.username, data, pay_id)
+    caption += f"🧾 Submission #{submission_id}\n"
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Approve", callback_data=f"approve_{user.id}_{submission_id}")]])
+
+    # Acknowledge first; the admin copy is built and sent in the background
     await message.answer(get_text(data, 'wait_approval'))
+    task = asyncio.create_task(send_application(dict(data), user, pay_id, caption, kb))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
-@dp.callback_query(F.data.startswith("approve_"))
-async def approve(callback: CallbackQuery):
-    uid = int(callback.data.split("_")[1])
-    await callback.message.edit_caption(caption=callback.message.caption + "\n\n✅ **DONE**")
+async def send_application(data, user, pay_id, caption, kb):
+    # Keep a local copy of every photo; the dossier and later exports read it from disk
+    await photo_archive.fetch_many(file_id for *_, file_id in submission_photos(data, pay_id))
     try:
-        await bot.send_message(uid, "✅ **APPROVED!** We are processing your application.")
-    except: pass
+        # One PDF dossier per applicant instead of a stream of loose photos
+        path = await build_dossier(bot, data, user.id, user.username, store=photo_archive)
+        filename = f"DV_{data.get('first_name')}_{data.get('last_name')}.pdf"
+        attachments = [lambda: bot.send_document(chat_id=ADMIN_ID, document=FSInputFile(path, filename=filename))]
+    except Exception as e:
+        logging.warning(f"Dossier for {user.id} failed, sending photos instead: {e}")
+        photos = [(data.get('main_photo_id'), f"📸 Main Photo: {data.get('first_name')}")]
+        if data.get('spouse_photo_id'):
+            photos.append((data.get('spouse_photo_id'), "📸 Spouse Photo"))
+        for i, child in enumerate(data.get('children') or []):
+            photos.append((child['photo_id'], f"📸 Child {i+1}: {child['name']}"))
+        attachments = photo_album_calls(bot, ADMIN_ID, photos)
+
+    outbox.submit(ADMIN_ID, [
+        lambda: bot.send_photo(chat_id=ADMIN_ID, photo=pay_id, caption=caption, reply_markup=kb),
+        *attachments,
+    ])
+
+# Every other form step goes through the step table
+@dp.message(StateFilter(*form_engine.states))
+async def form_step(message: Message, session: FormSession):
+    await form_engine.handle(message, session)
+
+@dp.callback_query(Magic(F.data.startswith("approve_")), is_admin)
+async def approve(callback: CallbackQuery):
+    # approve_<user id>_<submission id>; older buttons carry only the user id
+    parts = callback.data.split("_")
+    uid = int(parts[1])
+    legacy = len(parts) <= 2
+    ids = await submissions.pending_ids_for_user(uid) if legacy else [int(parts[2])]
+    approved = await submissions.approve(ids)
+    if not approved and not legacy:
+        # Double click, or approved meanwhile via /approve_batch
+        await callback.answer("Already approved")
+        return
+    await callback.message.edit_caption(caption=(callback.message.caption or "") + "\n\n✅ **DONE**")
+    # Legacy buttons may predate the submission store; notify the user regardless
+    notify_approved(approved or [{'user_id': uid, 'lang': None}])
+    await callback.answer()
+
+def notify_approved(rows):
+    # One job per user; the outbox keeps the whole batch within Telegram's rate limits
+    for row in rows:
+        uid, lang = row['user_id'], row['lang'] or 'en'
+        outbox.submit(uid, [lambda uid=uid, lang=lang: bot.send_message(uid, TRANS[lang]['approved'])])
+
+async def on_webhook_startup():
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        max_connections=min(HANDLER_CONCURRENCY, 100),
+        allowed_updates=dp.resolve_used_update_types(),
+    )
 
 async def main():
-    # Start the dummy web server first
-    start_server() 
-    print("🌍 Web Server started!")
-    
-    print("🤖 Bot is running...")
-    await dp.start_polling(bot)
+    storage.start()
+    outbox.start()
+    app = build_app()
+
+    if WEBHOOK_URL:
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+        dp.startup.register(on_webhook_startup)
+        setup_application(app, dp, bot=bot)
+        runner = await start_server(app)
+        print(f"🤖 Bot is running (webhook {WEBHOOK_PATH})...")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+    else:
+        # Local fallback: health route on the same loop, updates by long polling
+        runner = await start_server(app)
+        print("🌍 Web Server started!")
+        await bot.delete_webhook()
+        print("🤖 Bot is running...")
+        try:
+            await dp.start_polling(bot)
+        finally:
+            await runner.cleanup()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,341 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter)
+
+from ratelimit import TokenBucket
+
+BROADCAST_DIR = os.getenv("BROADCAST_DIR", "broadcasts")
+# Broadcast sends also take from the Outbox's global bucket (TELEGRAM_GLOBAL_RATE),
+# so this only caps the broadcast's share; the rest is left for replies to users
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 15))
+BROADCAST_CONCURRENCY = 10
+CHECKPOINT_INTERVAL = 2.0
+MAX_NETWORK_RETRIES = 3
+
+RUNNING, DONE, CANCELLED = 'running', 'done', 'cancelled'
+STAT_KEYS = ('sent', 'blocked', 'failed', 'retried')
+
+
+def load_audience(fsm_path, submissions_path, lang=None, states=None, status=None):
+    """
+    Private chats known to the bot as sorted [(chat_id, lang)]: users with
+    FSM data plus everyone who submitted. `states` (FSM state names such as
+    "main_menu") only matches FSM rows and `status` ("pending" /
+    "approved") only matches submissions, so together they match nobody;
+    `lang` applies to both.
+    """
+    audience = {}
+    if status is None:
+        db = sqlite3.connect(f"file:{fsm_path}?mode=ro", uri=True)
+        try:
+            sql = "SELECT chat_id, json_extract(data, '$.lang'), state FROM fsm WHERE chat_id = user_id"
+            for chat_id, user_lang, state in db.execute(sql):
+                if states and (state or "").rpartition(":")[2] not in states:
+                    continue
+                audience[chat_id] = user_lang or 'en'
+        except sqlite3.OperationalError:
+            pass   # no FSM table yet
+        finally:
+            db.close()
+    if not states and os.path.exists(submissions_path):
+        db = sqlite3.connect(f"file:{submissions_path}?mode=ro", uri=True)
+        try:
+            sql = "SELECT user_id, lang FROM submissions" + (" WHERE status = ?" if status else "")
+            for user_id, user_lang in db.execute(sql, (status,) if status else ()):
+                audience.setdefault(user_id, user_lang or 'en')
+        finally:
+            db.close()
+    return sorted((chat_id, user_lang) for chat_id, user_lang in audience.items()
+                  if lang is None or user_lang == lang)
+
+
+class Broadcast:
+    """One broadcast's checkpoint. The audience is stored next to it, one "chat_id lang" per line."""
+
+    def __init__(self, id, text, filters, total, cursor=0, done_ahead=(), stats=None, status=RUNNING,
+                 created_at=None, finished_at=None, elapsed=0.0):
+        self.id = id
+        self.text = text
+        self.filters = filters
+        self.total = total
+        self.cursor = cursor                # every position below this is done
+        self.done_ahead = set(done_ahead)   # positions >= cursor already done
+        self.stats = stats or dict.fromkeys(STAT_KEYS, 0)
+        self.status = status
+        self.created_at = created_at or time.time()
+        self.finished_at = finished_at
+        self.elapsed = elapsed              # seconds spent sending, over all runs
+
+    @property
+    def processed(self):
+        return self.cursor + len(self.done_ahead)
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'text': self.text, 'filters': self.filters, 'total': self.total,
+            'cursor': self.cursor, 'done_ahead': sorted(self.done_ahead), 'stats': self.stats,
+            'status': self.status, 'created_at': self.created_at, 'finished_at': self.finished_at,
+            'elapsed': self.elapsed,
+        }
+
+    def summary(self):
+        rate = self.processed / self.elapsed if self.elapsed else 0.0
+        line = (f"📣 {self.id} [{self.status}]: {self.processed}/{self.total} done, {self.stats['sent']} sent, "
+                f"{self.stats['blocked']} blocked, {self.stats['failed']} failed, {rate:.1f} msg/s")
+        if self.status == RUNNING and rate:
+            line += f", ~{(self.total - self.processed) / rate / 60:.0f} min left"
+        return line
+
+
+class Broadcaster:
+    """
+    Sends one text to many chats at `rate` messages/s, separately from the
+    Outbox so replies to users never wait behind a broadcast. RetryAfter
+    pauses the whole broadcast and halves the rate (it creeps back up as
+    sends succeed); users who blocked the bot are counted, not retried.
+    Every send also takes a token from `global_bucket` (the Outbox's), so
+    broadcast and replies together stay under the bot-wide limit.
+    Progress is checkpointed to `directory`, and a broadcast still running
+    at shutdown is resumed by `resume()` on the next start.
+    """
+
+    def __init__(self, bot: Bot, fsm_path, submissions_path, directory=BROADCAST_DIR, rate=BROADCAST_RATE,
+                 global_bucket=None, notify=None):
+        self.bot = bot
+        self.fsm_path = fsm_path
+        self.submissions_path = submissions_path
+        self.directory = directory
+        self.rate = rate
+        self.notify = notify   # called with the Broadcast when it finishes
+        self.bucket = TokenBucket(rate, min(rate, 5))
+        self.global_bucket = global_bucket
+        self._paused_until = 0.0
+        self._tasks = {}       # broadcast id -> task
+        self._active = {}      # broadcast id -> Broadcast
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, id, ext):
+        return os.path.join(self.directory, f"{id}.{ext}")
+
+    # --- CHECKPOINTS ---
+    def _save(self, b):
+        tmp = self._path(b.id, f"json.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(b.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp, self._path(b.id, "json"))
+
+    def _load(self, id):
+        with open(self._path(id, "json"), encoding='utf-8') as f:
+            return Broadcast(**json.load(f))
+
+    def _read_audience(self, id):
+        with open(self._path(id, "audience"), encoding='utf-8') as f:
+            return [(int(chat_id), lang) for chat_id, lang in (line.split() for line in f)]
+
+    def _lock(self, id):
+        # Only one process runs a broadcast; the lock dies with the process
+        fd = os.open(self._path(id, "lock"), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    # --- API ---
+    async def create(self, text, lang=None, states=None, status=None):
+        """Snapshot the audience, write the first checkpoint and start sending."""
+        filters = {'lang': lang, 'states': sorted(states) if states else None, 'status': status}
+        audience = await asyncio.to_thread(load_audience, self.fsm_path, self.submissions_path,
+                                           lang, states, status)
+        b = Broadcast(time.strftime('%Y%m%d-%H%M%S'), text, filters, len(audience))
+        while os.path.exists(self._path(b.id, "json")):
+            b.id += "-1"
+
+        def write():
+            with open(self._path(b.id, "audience"), 'w', encoding='utf-8') as f:
+                f.writelines(f"{chat_id} {user_lang}\n" for chat_id, user_lang in audience)
+            self._save(b)
+
+        await asyncio.to_thread(write)
+        self._start(b, audience)
+        return b
+
+    def resume(self):
+        """Restart broadcasts left running by a previous process. Returns how many were picked up."""
+        resumed = 0
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            id = name[:-len(".json")]
+            if id in self._tasks:
+                continue
+            try:
+                b = self._load(id)
+                if b.status != RUNNING:
+                    continue
+                audience = self._read_audience(id)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Broadcast {id} cannot be resumed: {e}")
+                continue
+            self._start(b, audience)
+            resumed += 1
+        return resumed
+
+    def cancel(self, id):
+        # A marker file, so it also reaches a broadcast running in another worker process
+        if not os.path.exists(self._path(id, "json")):
+            return False
+        open(self._path(id, "cancel"), 'w').close()
+        return True
+
+    def status(self, id=None):
+        """The named broadcast, or the most recent one."""
+        if id is None:
+            ids = sorted(name[:-len(".json")] for name in os.listdir(self.directory) if name.endswith(".json"))
+            if not ids:
+                return None
+            id = ids[-1]
+        if id in self._active:
+            return self._active[id]
+        try:
+            return self._load(id)
+        except (OSError, ValueError):
+            return None
+
+    def snapshot(self):
+        totals = dict.fromkeys(STAT_KEYS, 0)
+        for b in self._active.values():
+            for key in STAT_KEYS:
+                totals[key] += b.stats[key]
+        return {'active': len(self._active), 'rate': round(self.bucket.rate, 2), **totals}
+
+    async def close(self):
+        # Running broadcasts keep status "running" in their checkpoint and resume on the next start
+        for task in list(self._tasks.values()):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    # --- SENDING ---
+    def _start(self, b, audience):
+        task = asyncio.create_task(self._run(b, audience))
+        self._tasks[b.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(b.id, None))
+
+    async def _throttle(self):
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            elif self.bucket.try_take():
+                break
+            else:
+                await asyncio.sleep(self.bucket.wait_time())
+        if self.global_bucket is not None:
+            while not self.global_bucket.try_take():
+                await asyncio.sleep(self.global_bucket.wait_time())
+
+    async def _deliver(self, b, chat_id):
+        network_errors = 0
+        while True:
+            await self._throttle()
+            try:
+                await self.bot.send_message(chat_id, b.text)
+                b.stats['sent'] += 1
+                # Additive recovery after a RetryAfter slowdown
+                self.bucket.rate = min(self.rate, self.bucket.rate + 0.05)
+                return
+            except TelegramRetryAfter as e:
+                b.stats['retried'] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                self.bucket.rate = max(1.0, self.bucket.rate / 2)
+                logging.warning(f"Broadcast {b.id}: flood control, pausing {e.retry_after}s "
+                                f"and slowing to {self.bucket.rate:.1f} msg/s")
+            except TelegramForbiddenError:
+                b.stats['blocked'] += 1
+                return
+            except TelegramBadRequest as e:
+                b.stats['failed'] += 1
+                logging.warning(f"Broadcast {b.id} to {chat_id} failed: {e}")
+                return
+            except TelegramNetworkError:
+                network_errors += 1
+                if network_errors > MAX_NETWORK_RETRIES:
+                    b.stats['failed'] += 1
+                    return
+                b.stats['retried'] += 1
+                await asyncio.sleep(2 ** network_errors)
+            except Exception as e:
+                # Server errors and anything unexpected: count it, so the position is not marked done silently
+                b.stats['failed'] += 1
+                logging.warning(f"Broadcast {b.id} to {chat_id} failed: {e!r}")
+                return
+
+    async def _run(self, b, audience):
+        fd = self._lock(b.id)
+        if fd is None:
+            return   # another worker process has it
+        self._active[b.id] = b
+        slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        pending = set()
+        print(f"📣 Broadcast {b.id}: {b.total - b.processed} of {b.total} chats to go")
+
+        def finished(task, position):
+            pending.discard(task)
+            slots.release()
+            if task.cancelled():
+                return
+            b.done_ahead.add(position)
+            while b.cursor in b.done_ahead:
+                b.done_ahead.remove(b.cursor)
+                b.cursor += 1
+
+        async def checkpoint():
+            await asyncio.to_thread(self._save, b)
+            if os.path.exists(self._path(b.id, "cancel")):
+                b.status = CANCELLED
+
+        started = time.monotonic()
+        last_checkpoint = started
+        elapsed_before = b.elapsed
+        try:
+            for position in range(b.cursor, b.total):
+                if position in b.done_ahead:
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(self._deliver(b, audience[position][0]))
+                pending.add(task)
+                task.add_done_callback(lambda t, p=position: finished(t, p))
+                now = time.monotonic()
+                if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    last_checkpoint = now
+                    b.elapsed = elapsed_before + now - started
+                    await checkpoint()
+                    if b.status == CANCELLED:
+                        break
+            if pending:
+                await asyncio.wait(pending)
+            if b.status == RUNNING:
+                b.status = DONE
+            b.finished_at = time.time()
+        finally:
+            # On cancellation (shutdown) in-flight sends are abandoned and not marked done
+            for task in pending:
+                task.cancel()
+            b.elapsed = elapsed_before + time.monotonic() - started
+            await checkpoint()
+            self._active.pop(b.id, None)
+            os.close(fd)
+
+        print(b.summary())
+        if self.notify:
+            self.notify(b)
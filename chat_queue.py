@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from aiogram import Dispatcher
+
+
+def update_chat_id(update):
+    for event in (update.message, update.edited_message, update.callback_query, update.my_chat_member):
+        if event is None:
+            continue
+        message = getattr(event, 'message', None) or event
+        chat = getattr(message, 'chat', None)
+        if chat is not None:
+            return chat.id
+        if getattr(event, 'from_user', None):
+            return event.from_user.id
+    return None
+
+
+class ChatSequencer:
+    """
+    Updates from different chats run in parallel; updates from the same chat
+    run one at a time in arrival order, so read-modify-write handlers (the
+    children loop, current_child_index) never race. At most `max_chats`
+    chats are processed at once, and a chat with more than `max_per_chat`
+    updates waiting has the extras dropped.
+    """
+
+    def __init__(self, max_chats=100, max_per_chat=20):
+        self.max_chats = max_chats
+        self.max_per_chat = max_per_chat
+        self._slots = asyncio.Semaphore(max_chats)
+        self._chats = {}   # chat_id -> [lock, updates queued or running]
+        self.stats = {'dropped': 0, 'max_chat_queue': 0}
+
+    @asynccontextmanager
+    async def hold(self, chat_id):
+        if chat_id is None:
+            async with self._slots:
+                yield True
+            return
+
+        entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+        if entry[1] >= self.max_per_chat:
+            self.stats['dropped'] += 1
+            yield False
+            return
+        entry[1] += 1
+        self.stats['max_chat_queue'] = max(self.stats['max_chat_queue'], entry[1])
+        try:
+            # asyncio.Lock wakes waiters FIFO, which keeps per-chat order
+            async with entry[0]:
+                async with self._slots:
+                    yield True
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[chat_id]
+
+    def queue_lengths(self):
+        return {chat_id: entry[1] for chat_id, entry in self._chats.items()}
+
+    def snapshot(self):
+        lengths = self.queue_lengths()
+        return {
+            **self.stats,
+            'active_chats': len(lengths),
+            'queued_updates': sum(lengths.values()),
+            'longest_chat_queue': max(lengths.values(), default=0),
+        }
+
+
+class SequencedDispatcher(Dispatcher):
+    """
+    Dispatcher that passes every update through a ChatSequencer before any
+    middleware runs, so FSM state is read only once the chat's previous
+    update has finished. Works for both polling and webhook mode since both
+    end up in feed_update.
+    """
+
+    def __init__(self, *, max_chats=100, max_per_chat=20, **kwargs):
+        super().__init__(**kwargs)
+        self.sequencer = ChatSequencer(max_chats=max_chats, max_per_chat=max_per_chat)
+
+    async def feed_update(self, bot, update, **kwargs):
+        chat_id = update_chat_id(update)
+        async with self.sequencer.hold(chat_id) as admitted:
+            if not admitted:
+                logging.warning(f"Dropped update {update.update_id}: chat {chat_id} has too many queued")
+                return None
+            return await super().feed_update(bot, update, **kwargs)
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import InputMediaPhoto
+from cachetools import TTLCache
+
+from ratelimit import TokenBucket
+
+# Telegram: ~30 messages/s per bot overall, ~1 message/s per chat (short bursts are tolerated).
+# Worker processes (workers.py) each get a share of the global rate, and of the rate to
+# chats every worker sends to (the admin chat).
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+PER_CHAT_RATE = 1
+PER_CHAT_BURST = 3
+SHARED_CHAT_RATE = float(os.getenv("SHARED_CHAT_RATE", PER_CHAT_RATE))
+MEDIA_GROUP_SIZE = 10
+
+
+class Outbox:
+    """
+    Outbound delivery queue. A job is a list of zero-argument callables that
+    each make one Bot API call; a job's calls are sent in order and never
+    interleave with another job to the same chat. Every call waits for a
+    token from the global and per-chat buckets, and RetryAfter / network
+    errors are retried. `shared_chats` (e.g. the admin chat) are limited to
+    SHARED_CHAT_RATE instead of PER_CHAT_RATE.
+    """
+
+    def __init__(self, workers=4, max_retries=5, shared_chats=()):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.shared_chats = {str(chat_id) for chat_id in shared_chats}
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chat_buckets = TTLCache(maxsize=100_000, ttl=60)
+        self._chat_locks = {}   # chat_id -> [lock, jobs holding or waiting for it]
+        self._tasks = []
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    def submit(self, chat_id, calls):
+        """Queue a job and return immediately; the returned future resolves when it is delivered."""
+        fut = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((chat_id, list(calls), fut))
+        return fut
+
+    async def _throttle(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            rate = SHARED_CHAT_RATE if str(chat_id) in self.shared_chats else PER_CHAT_RATE
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, max(1, PER_CHAT_BURST * rate / PER_CHAT_RATE))
+        while not bucket.try_take():
+            await asyncio.sleep(bucket.wait_time())
+        while not self.global_bucket.try_take():
+            await asyncio.sleep(self.global_bucket.wait_time())
+
+    async def _call(self, chat_id, call):
+        for attempt in range(self.max_retries + 1):
+            await self._throttle(chat_id)
+            try:
+                result = await call()
+                self.stats['sent'] += 1
+                return result
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.stats['retried'] += 1
+                await asyncio.sleep(e.retry_after)
+            except TelegramNetworkError:
+                if attempt == self.max_retries:
+                    raise
+                self.stats['retried'] += 1
+                await asyncio.sleep(2 ** attempt)
+
+    async def _worker(self):
+        while True:
+            chat_id, calls, fut = await self.queue.get()
+            entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    results = [await self._call(chat_id, call) for call in calls]
+                if not fut.done():
+                    fut.set_result(results)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logging.warning(f"Delivery to {chat_id} failed: {e}")
+                if not fut.done():
+                    fut.set_exception(e)
+                    # Nobody may be awaiting it; don't log "exception never retrieved"
+                    fut.exception()
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._chat_locks[chat_id]
+                self.queue.task_done()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout=30):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Outbox closed with {self.queue.qsize()} jobs undelivered")
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+
+def photo_album_calls(bot: Bot, chat_id, photos):
+    """
+    Turn [(file_id, caption), ...] into send calls: albums of up to 10
+    photos, and a plain send_photo for a leftover single photo.
+    """
+    calls = []
+    for i in range(0, len(photos), MEDIA_GROUP_SIZE):
+        chunk = photos[i:i + MEDIA_GROUP_SIZE]
+        if len(chunk) == 1:
+            file_id, caption = chunk[0]
+            calls.append(lambda f=file_id, c=caption: bot.send_photo(chat_id=chat_id, photo=f, caption=c))
+        else:
+            media = [InputMediaPhoto(media=f, caption=c) for f, c in chunk]
+            calls.append(lambda m=media: bot.send_media_group(chat_id=chat_id, media=m))
+    return calls
@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import os
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from form import form_engine
+from process_pool import ProcessPool
+from texts import TRANS
+
+DOSSIER_DIR = os.getenv("DOSSIER_DIR", "dossiers")
+# The built-in PDF fonts have no Ethiopic glyphs; point this at a TTF that does
+# (e.g. NotoSansEthiopic-Regular.ttf) if names are typed in Amharic
+DOSSIER_FONT = os.getenv("DOSSIER_FONT")
+DOSSIER_WORKERS = int(os.getenv("DOSSIER_WORKERS", 2))
+
+pool = ProcessPool("Dossier", DOSSIER_WORKERS, preload=("reportlab.platypus", "reportlab.lib.styles"))
+_rendering = {}   # content hash -> task, so identical submissions share one render
+stats = {'rendered': 0, 'cache_hits': 0}
+
+
+def to_english(value):
+    # Button answers (gender, marital status) are stored in the user's language
+    for options in form_engine.options.values():
+        key = options.get(value)
+        if key:
+            return TRANS['en'][key]
+    return value
+
+
+def dossier_content(data, user_id, username):
+    """Everything that ends up in the PDF. Its hash is the cache key."""
+    children = [
+        {'name': c.get('name'), 'gender': to_english(c.get('gender')), 'photo_id': c.get('photo_id')}
+        for c in data.get('children') or []
+    ]
+    return {
+        'user_id': user_id,
+        'username': username,
+        'first_name': data.get('first_name'),
+        'last_name': data.get('last_name'),
+        'gender': to_english(data.get('gender')),
+        'marital_status': to_english(data.get('marital_status')),
+        'spouse_name': data.get('spouse_name'),
+        'spouse_gender': to_english(data.get('spouse_gender')),
+        'children': children,
+        'main_photo_id': data.get('main_photo_id'),
+        'spouse_photo_id': data.get('spouse_photo_id'),
+        'photo_issues': data.get('photo_issues') or {},
+    }
+
+
+def content_hash(content):
+    raw = json.dumps(content, sort_keys=True, ensure_ascii=False).encode()
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def photo_list(content):
+    photos = [("Main applicant", content['main_photo_id'])]
+    if content['spouse_photo_id']:
+        photos.append(("Spouse", content['spouse_photo_id']))
+    for i, child in enumerate(content['children']):
+        photos.append((f"Child {i+1}: {child['name']}", child['photo_id']))
+    return [(caption, file_id) for caption, file_id in photos if file_id]
+
+
+def render_dossier(path, content, photos, font_path=None):
+    """Build the PDF with reportlab. Runs in a worker process; `photos` is [(caption, jpeg bytes)]."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    styles = getSampleStyleSheet()
+    font = 'Helvetica'
+    if font_path:
+        pdfmetrics.registerFont(TTFont('DossierFont', font_path))
+        font = 'DossierFont'
+        for style in styles.byName.values():
+            style.fontName = font
+
+    def table(rows, widths):
+        t = Table(rows, colWidths=widths)
+        t.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), font),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('BACKGROUND', (0, 0), (0, -1), colors.whitesmoke),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ]))
+        return t
+
+    # Paragraph text is markup; user-typed names must not be parsed as tags
+    c = {k: escape(v) if isinstance(v, str) else v for k, v in content.items()}
+    story = [
+        Paragraph(f"DV Application: {c['first_name']} {c['last_name']}", styles['Title']),
+        Paragraph(f"Telegram: @{c['username']} (ID: {c['user_id']})", styles['Normal']),
+        Spacer(1, 0.4 * cm),
+        Paragraph("Main applicant", styles['Heading2']),
+        table([["First name", c['first_name']], ["Last name", c['last_name']],
+               ["Gender", c['gender']], ["Marital status", c['marital_status']]], [5 * cm, 11 * cm]),
+    ]
+    if c['spouse_name']:
+        story += [Paragraph("Spouse", styles['Heading2']),
+                  table([["Full name", c['spouse_name']], ["Gender", c['spouse_gender']]], [5 * cm, 11 * cm])]
+    if c['children']:
+        rows = [[f"Child {i+1}", f"{child['name']} ({child['gender']})"] for i, child in enumerate(content['children'])]
+        story += [Paragraph("Children", styles['Heading2']), table(rows, [5 * cm, 11 * cm])]
+    if c['photo_issues']:
+        rows = [[label, ", ".join(i.replace('photo_', '').replace('_', ' ') for i in issues)]
+                for label, issues in c['photo_issues'].items()]
+        story += [Paragraph("Photo check warnings", styles['Heading2']), table(rows, [5 * cm, 11 * cm])]
+
+    # Photos, three per row
+    cells = []
+    for caption, raw in photos:
+        cells.append([Image(BytesIO(raw), width=4.5 * cm, height=4.5 * cm, kind='proportional'),
+                      Paragraph(escape(caption), styles['Normal'])])
+    if cells:
+        grid = [cells[i:i + 3] for i in range(0, len(cells), 3)]
+        grid[-1] += [""] * (3 - len(grid[-1]))
+        story += [Paragraph("Photos", styles['Heading2']),
+                  Table(grid, colWidths=[5.5 * cm] * 3, style=[('VALIGN', (0, 0), (-1, -1), 'TOP')])]
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    SimpleDocTemplate(tmp, pagesize=A4, title=f"DV {c['first_name']} {c['last_name']}").build(story)
+    os.replace(tmp, path)
+    return path
+
+
+async def _download(bot, file_id):
+    buffer = await bot.download(file_id, destination=BytesIO())
+    return buffer.getvalue()
+
+
+async def _render(content, path, bot, store=None):
+    photos = photo_list(content)
+    read = store.read if store else lambda file_id: _download(bot, file_id)
+    blobs = await asyncio.gather(*(read(file_id) for _, file_id in photos))
+    photos = [(caption, raw) for (caption, _), raw in zip(photos, blobs)]
+    await pool.run(render_dossier, path, content, photos, DOSSIER_FONT)
+    stats['rendered'] += 1
+    return path
+
+
+async def build_dossier(bot, data, user_id, username, store=None):
+    """
+    Return the path of the applicant's PDF, rendering it only if this exact
+    content is new. Photos come from `store` (a PhotoStore) when given.
+    """
+    content = dossier_content(data, user_id, username)
+    key = content_hash(content)
+    path = os.path.join(DOSSIER_DIR, f"{key}.pdf")
+    if os.path.exists(path):
+        stats['cache_hits'] += 1
+        return path
+
+    task = _rendering.get(key)
+    if task is None:
+        os.makedirs(DOSSIER_DIR, exist_ok=True)
+        task = _rendering[key] = asyncio.ensure_future(_render(content, path, bot, store))
+        task.add_done_callback(lambda _: _rendering.pop(key, None))
+    else:
+        stats['cache_hits'] += 1
+    return await asyncio.shield(task)
+
+
+def close():
+    pool.close()
@@ -0,0 +1,146 @@
+import json
+import math
+import os
+from collections import Counter, defaultdict
+
+from ai_service import normalize_question
+from texts import TRANS
+
+FAQ_FILE = os.getenv("FAQ_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "faq_data.json"))
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", 0.4))
+NGRAM = 3
+WORD = "w:"   # prefix of word and word-pair features
+# A query word no answerable FAQ question uses (nor a close spelling of one) means the question is
+# about something else: "interview fee" is not "fee"
+NEAR_WORD = 0.5
+STOPWORDS = frozenset("""
+a an the is are am was were be been do does did i me my we our you your it its this that these those
+to of in on for with and or at by from about so if not no can could will would should shall may might
+must how what when where who why which there here please hi hello thanks thank ok
+ነው ናቸው ምን ምንድን ምንድነው ምንድናቸው እንዴት መቼ የት ማን ለምን አለ እችላለሁ ይቻላል እባክህ እባክሽ ሰላም
+""".split())
+
+
+def char_ngrams(text):
+    # Pad each word so short Amharic words still produce n-grams
+    grams = Counter()
+    for word in normalize_question(text).split():
+        padded = f" {word} "
+        if len(padded) <= NGRAM:
+            grams[padded] += 1
+            continue
+        for i in range(len(padded) - NGRAM + 1):
+            grams[padded[i:i + NGRAM]] += 1
+    return grams
+
+
+def features(text):
+    """
+    Character trigrams tolerate typos and Amharic affixes; whole words and
+    word pairs keep "education requirement" from matching "photo
+    requirements" on shared trigrams alone.
+    """
+    grams = char_ngrams(text)
+    words = normalize_question(text).split()
+    grams.update(f"{WORD}{w}" for w in words)
+    grams.update(f"{WORD}{a} {b}" for a, b in zip(words, words[1:]))
+    return grams
+
+
+def _word_grams(word):
+    padded = f" {word} "
+    return {padded[i:i + NGRAM] for i in range(max(1, len(padded) - NGRAM + 1))}
+
+
+class FAQIndex:
+    """
+    TF-IDF over character trigrams plus words and word pairs, kept as a
+    sparse inverted index. Every known question variant is one row; a
+    lookup is a single pass over the postings of the query's features
+    (cosine similarity). Query words the index has never seen count at the
+    highest IDF, so a question about something no FAQ covers scores low,
+    and `lookup` refuses outright when a content word is not used by any
+    answerable question. Entries with "answer": null are negative
+    examples: questions close to an FAQ that still need the AI.
+    """
+
+    def __init__(self, entries):
+        self.answers = []   # row -> (lang, answer)
+        self.vocabulary = set()   # words of answerable questions
+        rows = []
+        for entry in entries:
+            lang = entry['lang']
+            answer = TRANS[lang][entry['text_key']] if 'text_key' in entry else entry['answer']
+            for question in entry['questions']:
+                rows.append(features(question))
+                self.answers.append((lang, answer))
+                if answer is not None:
+                    self.vocabulary.update(normalize_question(question).split())
+        self.word_postings = defaultdict(set)   # trigram -> vocabulary words containing it
+        for word in self.vocabulary:
+            for g in _word_grams(word):
+                self.word_postings[g].add(word)
+
+        df = Counter()
+        for grams in rows:
+            df.update(grams.keys())
+        n = len(rows)
+        self.idf = {g: math.log((1 + n) / (1 + c)) + 1 for g, c in df.items()}
+        self.unseen_idf = math.log(1 + n) + 1
+
+        self.postings = defaultdict(list)   # ngram -> [(row, weight)]
+        for row, grams in enumerate(rows):
+            vec = {g: tf * self.idf[g] for g, tf in grams.items()}
+            norm = math.sqrt(sum(w * w for w in vec.values())) or 1.0
+            for g, w in vec.items():
+                self.postings[g].append((row, w / norm))
+
+    @classmethod
+    def from_file(cls, path=FAQ_FILE):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def search(self, text):
+        grams = features(text)
+        # Unknown trigrams are usually typos and are ignored; unknown words are not
+        vec = {g: tf * self.idf.get(g, self.unseen_idf) for g, tf in grams.items()
+               if g in self.idf or g.startswith(WORD)}
+        if not any(g in self.idf for g in vec):
+            return None, 0.0
+        norm = math.sqrt(sum(w * w for w in vec.values()))
+        scores = defaultdict(float)
+        for g, w in vec.items():
+            for row, rw in self.postings.get(g, ()):
+                scores[row] += w * rw
+        row, score = max(scores.items(), key=lambda item: item[1])
+        return row, score / norm
+
+    def known_word(self, word):
+        """In the vocabulary, or a close spelling (typo, Amharic affix) of a word that is."""
+        if word in self.vocabulary or word in STOPWORDS or len(word) < 2:
+            return True
+        grams = _word_grams(word)
+        shared = Counter(w for g in grams for w in self.word_postings.get(g, ()))
+        return any(2 * n / (len(grams) + len(_word_grams(w))) >= NEAR_WORD for w, n in shared.items())
+
+    def covers(self, text):
+        return all(self.known_word(w) for w in normalize_question(text).split())
+
+    def lookup(self, text, threshold=FAQ_THRESHOLD):
+        row, score = self.search(text)
+        if row is None or score < threshold or not self.covers(text):
+            return None
+        return self.answers[row][1]
+
+
+try:
+    faq_index = FAQIndex.from_file()
+except Exception as e:
+    print(f"⚠️ FAQ index not loaded: {e}")
+    faq_index = None
+
+
+def answer_locally(text):
+    if faq_index is None:
+        return None
+    return faq_index.lookup(text)
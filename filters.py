@@ -0,0 +1,12 @@
+from aiogram.filters import Filter
+from magic_filter import MagicFilter
+
+
+class Magic(Filter):
+    """A magic filter evaluated on the event loop; aiogram runs sync filters via asyncio.to_thread."""
+
+    def __init__(self, magic: MagicFilter):
+        self.magic = magic
+
+    async def __call__(self, event):
+        return bool(self.magic.resolve(event))
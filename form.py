@@ -0,0 +1,235 @@
+from dataclasses import dataclass
+from typing import Callable
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import KeyboardButton, Message, ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+import photo_check
+from session import FormSession
+from texts import TRANS
+
+
+# STATES
+class DVFlow(StatesGroup):
+    choosing_lang = State()
+    main_menu = State()
+    first_name = State()
+    last_name = State()
+    gender = State()
+    marital_status = State()
+    spouse_name = State()
+    spouse_gender = State()
+    spouse_photo = State()
+    has_children = State()
+    children_count = State()
+    child_name = State()
+    child_gender = State()
+    child_photo = State()
+    main_photo = State()
+    review_info = State()
+    payment_upload = State()
+
+# HELPER
+def get_text(data, key):
+    lang = data.get('lang', 'en')
+    return TRANS[lang].get(key, "Text Missing")
+
+
+# --- STEP TABLE ---
+TEXT, CHOICE, NUMBER, PHOTO = 'text', 'choice', 'number', 'photo'
+
+@dataclass(frozen=True)
+class Step:
+    state: State
+    prompt: str | Callable             # TRANS key, or fn(data) -> text
+    kind: str
+    field: str | None = None           # where the answer is stored
+    choices: tuple = ()                # rows of TRANS keys, shown as buttons
+    min_len: int = 1
+    min_value: int | None = None
+    max_value: int | None = None
+    error: str = 'err_use_buttons'     # TRANS key sent on invalid input
+    save: Callable | None = None       # fn(session, value, choice_key) instead of storing `field`
+    next: State | Callable | None = None   # State, or fn(data, choice_key) -> State; None = own handler
+    check_photo: str | None = None     # run the DV photo check; label used in feedback ("Child {n}")
+
+
+# Gender button text in any language -> (lang, key)
+GENDER_KEYS = {TRANS[lang][key]: (lang, key) for lang in TRANS for key in ('male', 'female')}
+OPPOSITE_GENDER = {'male': 'female', 'female': 'male'}
+
+def save_spouse_name(session: FormSession, value, key):
+    lang, gender_key = GENDER_KEYS.get(session.get('gender'), (None, None))
+    spouse_sex = TRANS[lang][OPPOSITE_GENDER[gender_key]] if gender_key in OPPOSITE_GENDER else "Unknown"
+    session.update(spouse_name=value, spouse_gender=spouse_sex)
+
+def save_child_count(session: FormSession, value, key):
+    session.update(total_children=value, current_child_index=1, children=[])
+
+def save_child(session: FormSession, value, key):
+    children = session.data.setdefault('children', [])
+    children.append({
+        'name': session.get('temp_child_name'),
+        'gender': session.get('temp_child_gender'),
+        'photo_id': value,
+    })
+    session.update(current_child_index=len(children) + 1)
+
+def review_summary(data):
+    spouse_txt = f"\n💍 Spouse: {data.get('spouse_name')}" if data.get('spouse_name') else ""
+    child_txt = ""
+    if data.get('children'):
+        for i, child in enumerate(data['children']):
+            child_txt += f"\n👶 Child {i+1}: {child['name']} ({child['gender']})"
+
+    return (
+        f"{get_text(data, 'review_title')}\n\n"
+        f"👤 Name: {data.get('first_name')} {data.get('last_name')}\n"
+        f"⚧ Gender: {data.get('gender')}\n"
+        f"❤️ Status: {data.get('marital_status')}"
+        f"{spouse_txt}"
+        f"{child_txt}\n\n"
+        f"📸 Main Photo: [Received]"
+    )
+
+STEPS = [
+    Step(DVFlow.first_name, 'ask_firstname', TEXT, field='first_name', min_len=2, error='err_name_short',
+         next=DVFlow.last_name),
+    Step(DVFlow.last_name, 'ask_lastname', TEXT, field='last_name', next=DVFlow.gender),
+    Step(DVFlow.gender, 'ask_gender', CHOICE, field='gender', choices=(('male', 'female'),),
+         next=DVFlow.marital_status),
+    Step(DVFlow.marital_status, 'ask_marital', CHOICE, field='marital_status',
+         choices=(('single', 'married'), ('divorced', 'widowed')),
+         next=lambda data, key: DVFlow.spouse_name if key == 'married' else DVFlow.has_children),
+    # SPOUSE FLOW
+    Step(DVFlow.spouse_name, 'ask_spouse_name', TEXT, save=save_spouse_name, next=DVFlow.spouse_photo),
+    Step(DVFlow.spouse_photo, 'ask_spouse_photo', PHOTO, field='spouse_photo_id', check_photo="Spouse",
+         next=DVFlow.has_children),
+    # CHILDREN
+    Step(DVFlow.has_children, 'ask_has_children', CHOICE, choices=(('yes', 'no'),),
+         next=lambda data, key: DVFlow.children_count if key == 'yes' else DVFlow.main_photo),
+    Step(DVFlow.children_count, 'ask_child_count', NUMBER, min_value=1, max_value=20, error='err_child_count',
+         save=save_child_count, next=DVFlow.child_name),
+    Step(DVFlow.child_name, 'ask_child_name', TEXT, field='temp_child_name', next=DVFlow.child_gender),
+    Step(DVFlow.child_gender, 'ask_child_gender', CHOICE, field='temp_child_gender', choices=(('male', 'female'),),
+         next=DVFlow.child_photo),
+    Step(DVFlow.child_photo, 'ask_child_photo', PHOTO, save=save_child, check_photo="Child {n}",
+         next=lambda data, key: DVFlow.child_name if len(data['children']) < data['total_children'] else DVFlow.main_photo),
+    # MAIN PHOTO, REVIEW & PAYMENT
+    Step(DVFlow.main_photo, 'ask_main_photo', PHOTO, field='main_photo_id', check_photo="Main",
+         next=DVFlow.review_info),
+    Step(DVFlow.review_info, review_summary, CHOICE, choices=(('btn_confirm',), ('btn_edit',)),
+         next=lambda data, key: DVFlow.first_name if key == 'btn_edit' else DVFlow.payment_upload),
+    Step(DVFlow.payment_upload, 'payment_msg', PHOTO),
+]
+
+
+class FormEngine:
+    """
+    Runs the form from the step table. Everything derived from TRANS (valid
+    button texts, keyboards per language) is built once here, so handling a
+    message is a dict lookup plus one reply.
+    """
+
+    def __init__(self, steps):
+        self.steps = {step.state.state: step for step in steps}
+        self.options = {}     # state -> {button text (any language): key}
+        self.keyboards = {}   # state -> {lang: ReplyKeyboardMarkup}
+        self.remove = ReplyKeyboardRemove()
+        for step in steps:
+            if step.kind != CHOICE:
+                continue
+            keys = [key for row in step.choices for key in row]
+            self.options[step.state.state] = {TRANS[lang][key]: key for lang in TRANS for key in keys}
+            self.keyboards[step.state.state] = {
+                lang: ReplyKeyboardMarkup(
+                    keyboard=[[KeyboardButton(text=TRANS[lang][key]) for key in row] for row in step.choices],
+                    resize_keyboard=True)
+                for lang in TRANS
+            }
+        # States answered by the generic handler (steps without `next` have their own)
+        self.states = [step.state for step in steps if step.next is not None]
+
+    def keyboard(self, step, data):
+        kb = self.keyboards.get(step.state.state)
+        return kb[data.get('lang', 'en')] if kb else self.remove
+
+    async def enter(self, message: Message, session: FormSession, state: State):
+        step = self.steps[state.state]
+        data = session.data
+        if callable(step.prompt):
+            text = step.prompt(data)
+        else:
+            text = get_text(data, step.prompt).format(n=data.get('current_child_index'))
+        await message.answer(text, reply_markup=self.keyboard(step, data))
+        session.set_state(state)
+
+    async def reject(self, message: Message, session: FormSession, step, error_key):
+        await message.answer(get_text(session.data, error_key), reply_markup=self.keyboard(step, session.data))
+
+    def parse(self, step, message: Message):
+        """Return (value, choice_key, error_key)."""
+        if step.kind == PHOTO:
+            if not message.photo:
+                return None, None, 'need_photo'
+            return message.photo[-1].file_id, None, None
+        text = message.text
+        if not text:
+            return None, None, 'err_need_text' if step.kind != CHOICE else step.error
+        if step.kind == CHOICE:
+            key = self.options[step.state.state].get(text)
+            return (text, key, None) if key else (None, None, step.error)
+        if step.kind == NUMBER:
+            try:
+                value = int(text)
+            except ValueError:
+                return None, None, 'err_number'
+            if not step.min_value <= value <= step.max_value:
+                return None, None, step.error
+            return value, None, None
+        if len(text) < step.min_len:
+            return None, None, step.error
+        return text, None, None
+
+    async def review_photo(self, message: Message, session: FormSession, step):
+        """Run the DV photo check; return False if the step should wait for a new photo."""
+        issues = await photo_check.check_photo(message.bot, message.photo[-1])
+        if not issues:
+            return True
+
+        data = session.data
+        label = step.check_photo.format(n=data.get('current_child_index'))
+        strict = photo_check.PHOTO_CHECK_MODE == 'strict'
+        lines = [get_text(data, 'photo_issues_title').format(label=label)]
+        lines += [get_text(data, issue) for issue in issues]
+        lines.append(get_text(data, 'photo_retry' if strict else 'photo_accepted_anyway'))
+        await message.answer("\n".join(lines))
+        if strict:
+            return False
+        # Kept for the admin summary
+        data.setdefault('photo_issues', {})[label] = issues
+        session.touch()
+        return True
+
+    async def handle(self, message: Message, session: FormSession):
+        step = self.steps[session.state]
+        value, key, error = self.parse(step, message)
+        if error:
+            await self.reject(message, session, step, error)
+            return
+
+        if step.check_photo and photo_check.PHOTO_CHECK_MODE != 'off':
+            if not await self.review_photo(message, session, step):
+                return
+
+        if step.save:
+            step.save(session, value, key)
+        elif step.field:
+            session.update(**{step.field: value})
+
+        # State objects are callable (they double as filters), so check the type explicitly
+        next_state = step.next if isinstance(step.next, State) else step.next(session.data, key)
+        await self.enter(message, session, next_state)
+
+
+form_engine = FormEngine(STEPS)
@@ -1,19 +1,27 @@
-from flask import Flask
-from threading import Thread
 import os
 
-app = Flask(__name__)
+from aiohttp import web
 
-@app.route('/')
-def home():
-    return "✅ DV Bot is Alive and Running!"
+from metrics import metrics_view
 
-def run():
+
+async def home(request):
+    return web.Response(text="✅ DV Bot is Alive and Running!")
+
+
+def build_app():
+    # One aiohttp app for health checks, the Telegram webhook and admin endpoints
+    app = web.Application()
+    app.router.add_get('/', home)
+    app.router.add_get('/metrics', metrics_view)
+    return app
+
+
+async def start_server(app):
     # Render assigns a random port to the PORT environment variable
     # We must listen on that port, or default to 10000 for local testing
     port = int(os.environ.get("PORT", 10000))
-    app.run(host='0.0.0.0', port=port)
-
-def start_server():
-    t = Thread(target=run)
-    t.start()
\ No newline at end of file
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host='0.0.0.0', port=port).start()
+    return runner
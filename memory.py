@@ -0,0 +1,106 @@
+from collections import deque
+from dataclasses import dataclass, field
+
+from cachetools import TTLCache
+
+# Stored turns are clipped; the model only needs the gist of earlier answers
+MAX_QUESTION_CHARS = 400
+MAX_ANSWER_CHARS = 600
+SUMMARY_QUESTION_CHARS = 80
+
+
+def estimate_tokens(text):
+    # No tokenizer at hand: ~4 Latin characters per token, Ethiopic script
+    # splits into far more tokens per character
+    ascii_chars = sum(1 for ch in text if ch < '\x80')
+    return ascii_chars // 4 + (len(text) - ascii_chars) // 2 + 1
+
+
+def _clip(text, limit):
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+@dataclass
+class Context:
+    """What the provider sees before the new question: a summary line plus recent turns."""
+    summary: str = ""
+    turns: list = field(default_factory=list)   # [(question, answer)], oldest first
+
+    @property
+    def empty(self):
+        return not self.summary and not self.turns
+
+
+class _History:
+    __slots__ = ("turns", "earlier")
+
+    def __init__(self, max_turns, summary_items):
+        self.turns = deque(maxlen=max_turns)        # (question, answer)
+        self.earlier = deque(maxlen=summary_items)  # clipped questions that fell out of `turns`
+
+
+class ConversationMemory:
+    """
+    Recent AI-helper turns per user. Each user keeps a fixed ring of
+    `max_turns` question/answer pairs; pairs pushed out of the ring survive
+    only as a short list of the questions asked. At most `max_users`
+    histories are held, and one idle for `idle_ttl` seconds is dropped.
+    `context()` trims the history to a token budget, newest turns first.
+    """
+
+    def __init__(self, max_turns=6, max_users=5000, idle_ttl=1800, token_budget=700, summary_items=5):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_items = summary_items
+        self._users = TTLCache(maxsize=max_users, ttl=idle_ttl)
+        self.stats = {'turns_added': 0, 'turns_trimmed': 0}
+
+    def __len__(self):
+        return len(self._users)
+
+    def add(self, user_id, question, answer):
+        history = self._users.get(user_id)
+        if history is None:
+            history = _History(self.max_turns, self.summary_items)
+        if len(history.turns) == history.turns.maxlen:
+            history.earlier.append(_clip(history.turns[0][0], SUMMARY_QUESTION_CHARS))
+        history.turns.append((_clip(question, MAX_QUESTION_CHARS), _clip(answer, MAX_ANSWER_CHARS)))
+        # Re-inserting restarts the idle timer
+        self._users[user_id] = history
+        self.stats['turns_added'] += 1
+
+    def clear(self, user_id):
+        self._users.pop(user_id, None)
+
+    def context(self, user_id, token_budget=None):
+        history = self._users.get(user_id)
+        if history is None:
+            return Context()
+        budget = self.token_budget if token_budget is None else token_budget
+
+        earlier = list(history.earlier)
+        kept = []
+        used = 0
+        for question, answer in reversed(history.turns):
+            cost = estimate_tokens(question) + estimate_tokens(answer)
+            if used + cost > budget:
+                break
+            kept.append((question, answer))
+            used += cost
+        kept.reverse()
+
+        # Turns that did not fit are summarised by their question only
+        trimmed = list(history.turns)[:len(history.turns) - len(kept)]
+        if trimmed:
+            self.stats['turns_trimmed'] += len(trimmed)
+            earlier += [_clip(q, SUMMARY_QUESTION_CHARS) for q, _ in trimmed]
+
+        summary = ""
+        while earlier:
+            summary = "Earlier in this chat the user asked about: " + "; ".join(earlier) + "."
+            if used + estimate_tokens(summary) <= budget:
+                break
+            earlier.pop(0)
+            summary = ""
+        return Context(summary, kept)
@@ -0,0 +1,194 @@
+import os
+import time
+from bisect import bisect_left
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+# Seconds. Covers cache hits (sub-ms) up to slow Gemini answers
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Optional: require ?token=... (or a Bearer header) on /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class Registry:
+    """
+    In-process counters, histograms and gauges, rendered in the Prometheus
+    text format. Recording is a dict lookup and a few additions, so it is
+    cheap enough for every update and every Bot API call.
+    """
+
+    def __init__(self):
+        self.help = {}
+        self.histograms = {}   # (name, labels) -> Histogram
+        self.counters = {}     # (name, labels) -> float
+        self.gauges = {}       # name -> (label name, fn)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(labels.items()))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(labels.items()))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, fn, label=None, help=None):
+        """
+        `fn()` returns a number, or a {label value: number} dict when `label`
+        is given. With a tuple of label names the dict keys are tuples too.
+        """
+        self.gauges[name] = (label, fn)
+        if help:
+            self.help[name] = help
+
+    def describe(self, name, help):
+        self.help[name] = help
+
+    def render(self):
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items(), key=lambda kv: kv[0][0]):
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0][0]):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), hist.counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {hist.total:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+
+        for name, (label, fn) in self.gauges.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            header(name, "gauge")
+            if label is None:
+                lines.append(f"{name} {value}")
+            else:
+                names = label if isinstance(label, tuple) else (label,)
+                for label_value, v in value.items():
+                    values = label_value if isinstance(label, tuple) else (label_value,)
+                    lines.append(f"{name}{_labels(tuple(zip(names, values)))} {v}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+registry = Registry()
+observe = registry.observe
+inc = registry.inc
+
+registry.describe("dvbot_update_seconds", "Whole update, from feed_update to the storage flush")
+registry.describe("dvbot_handler_seconds", "Time spent in each handler, by handler and FSM state")
+registry.describe("dvbot_handler_errors_total", "Handlers that raised")
+registry.describe("dvbot_funnel_entered_total", "Times a user entered each FSM state")
+registry.describe("dvbot_funnel_users", "Users whose saved FSM state is each state (from storage, refreshed every 30s)")
+registry.describe("dvbot_ai_seconds", "Full AI answer latency by provider (cache misses only)")
+registry.describe("dvbot_ai_first_chunk_seconds", "Time to the first streamed chunk by provider")
+registry.describe("dvbot_ai_requests_total", "AI answers by outcome (ok, busy, unavailable)")
+registry.describe("dvbot_ai_attempts_total", "Provider calls by outcome, including failovers and hedges")
+registry.describe("dvbot_telegram_seconds", "Outbound Bot API call latency by method")
+registry.describe("dvbot_telegram_errors_total", "Outbound Bot API calls that failed")
+registry.describe("dvbot_storage_seconds", "FSM storage disk operations")
+
+
+# --- UPDATES & HANDLERS ---
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer update middleware: total time per update, by update type."""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            observe("dvbot_update_seconds", time.perf_counter() - started, type=event.event_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner middleware (register it before FormSessionMiddleware so it sees the
+    session's final state): per-handler and per-state latency, errors, and
+    funnel counts for state transitions.
+    """
+
+    async def __call__(self, handler, event, data):
+        state = data.get("raw_state") or "none"
+        name = data["handler"].callback.__name__ if "handler" in data else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            inc("dvbot_handler_errors_total", handler=name, state=state)
+            raise
+        finally:
+            observe("dvbot_handler_seconds", time.perf_counter() - started, handler=name, state=state)
+            session = data.get("session")
+            if session is not None and session.state and session.state != data.get("raw_state"):
+                inc("dvbot_funnel_entered_total", state=session.state)
+
+
+# --- OUTBOUND BOT API CALLS ---
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """bot.session middleware: latency of every Bot API call, by method."""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            inc("dvbot_telegram_errors_total", method=name, error=type(e).__name__)
+            raise
+        finally:
+            observe("dvbot_telegram_seconds", time.perf_counter() - started, method=name)
+
+
+# --- HTTP ---
+async def metrics_view(request):
+    if METRICS_TOKEN:
+        supplied = request.query.get("token") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if supplied != METRICS_TOKEN:
+            return web.Response(status=401)
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                        headers={"Cache-Control": "no-store"})
@@ -0,0 +1,100 @@
+import logging
+import os
+from io import BytesIO
+
+from cachetools import TTLCache
+
+from process_pool import ProcessPool
+
+# off: accept anything | warn: accept but tell the user | strict: ask for a new photo
+PHOTO_CHECK_MODE = os.getenv("PHOTO_CHECK_MODE", "warn")
+PHOTO_CHECK_WORKERS = int(os.getenv("PHOTO_CHECK_WORKERS", 2))
+
+MIN_SIDE = 600
+THUMB = 120
+
+pool = ProcessPool("Photo check", PHOTO_CHECK_WORKERS, preload=("PIL.Image", "PIL.ImageOps", "PIL.ImageStat"))
+# file_unique_id -> issues; the same photo re-sent (or re-checked) costs nothing
+_results = TTLCache(maxsize=20_000, ttl=24 * 3600)
+stats = {'checked': 0, 'cache_hits': 0, 'failed': 0}
+
+
+def check_photo_bytes(raw):
+    """
+    DV photo heuristics on raw image bytes. Runs in a worker process.
+    Returns a list of issue keys (texts.py keys), empty if the photo looks fine.
+    """
+    from PIL import Image, ImageOps, ImageStat
+
+    try:
+        img = ImageOps.exif_transpose(Image.open(BytesIO(raw))).convert('RGB')
+    except Exception:
+        return ['photo_unreadable']
+
+    issues = []
+    w, h = img.size
+    if min(w, h) < MIN_SIDE:
+        issues.append('photo_too_small')
+    if abs(w - h) > 0.05 * max(w, h):
+        issues.append('photo_not_square')
+
+    thumb = img.resize((THUMB, THUMB))
+    gray = thumb.convert('L')
+
+    brightness = ImageStat.Stat(gray).mean[0]
+    if brightness < 70:
+        issues.append('photo_too_dark')
+    elif brightness > 235:
+        issues.append('photo_too_bright')
+
+    # Background: the top corners should be bright and nearly colourless
+    band = THUMB // 6
+    corners = [thumb.crop((0, 0, band, band * 2)), thumb.crop((THUMB - band, 0, THUMB, band * 2))]
+    bg_light = sum(ImageStat.Stat(c.convert('L')).mean[0] for c in corners) / 2
+    bg_sat = sum(ImageStat.Stat(c.convert('HSV')).mean[1] for c in corners) / 2
+    if bg_light < 190 or bg_sat > 40:
+        issues.append('photo_background')
+    else:
+        # Face-centred crop: everything clearly darker than the background is "subject";
+        # its horizontal centre of mass should sit in the middle of the frame
+        pixels = gray.load()
+        cutoff = bg_light - 40
+        total = weighted = 0
+        for y in range(THUMB):
+            for x in range(THUMB):
+                if pixels[x, y] < cutoff:
+                    total += 1
+                    weighted += x
+        if total < THUMB * THUMB * 0.1:
+            issues.append('photo_not_centered')
+        elif abs(weighted / total - THUMB / 2) > THUMB * 0.12:
+            issues.append('photo_not_centered')
+
+    return issues
+
+
+async def check_photo(bot, photo):
+    """
+    Download the given PhotoSize and check it off the event loop. Cached by
+    file_unique_id. If the download or the check fails the photo is
+    accepted unchecked (no issues) rather than blocking the form.
+    """
+    cached = _results.get(photo.file_unique_id)
+    if cached is not None:
+        stats['cache_hits'] += 1
+        return cached
+
+    try:
+        buffer = await bot.download(photo.file_id, destination=BytesIO())
+        issues = await pool.run(check_photo_bytes, buffer.getvalue())
+    except Exception as e:
+        stats['failed'] += 1
+        logging.warning(f"Photo check failed, accepting photo unchecked: {e}")
+        return []
+    _results[photo.file_unique_id] = issues
+    stats['checked'] += 1
+    return issues
+
+
+def close():
+    pool.close()
@@ -0,0 +1,240 @@
+import asyncio
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+
+import aiofiles
+import aiofiles.os
+from aiogram import Bot
+
+PHOTO_DIR = os.getenv("PHOTO_DIR", "photos")
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+CHUNK_SIZE = 64 * 1024
+FETCH_CONCURRENCY = 8
+
+MANIFEST_FIELDS = ('submission_id', 'user_id', 'username', 'status', 'submitted_at', 'role', 'name', 'gender',
+                   'file', 'sha256', 'size')
+
+
+def submission_photos(data, payment_photo_id=None):
+    """[(role, name, gender, file_id)] for every photo in a submission's form data."""
+    full_name = f"{data.get('first_name') or ''} {data.get('last_name') or ''}".strip()
+    photos = [('main', full_name, data.get('gender'), data.get('main_photo_id'))]
+    if data.get('spouse_photo_id'):
+        photos.append(('spouse', data.get('spouse_name'), data.get('spouse_gender'), data['spouse_photo_id']))
+    for i, child in enumerate(data.get('children') or []):
+        photos.append((f"child{i + 1}", child.get('name'), child.get('gender'), child.get('photo_id')))
+    if payment_photo_id:
+        photos.append(('payment', None, None, payment_photo_id))
+    return [photo for photo in photos if photo[3]]
+
+
+def _slug(text):
+    return re.sub(r'[^\w-]+', '_', text or '').strip('_')[:40] or 'x'
+
+
+class PhotoStore:
+    """
+    Applicant photos on local disk, downloaded from Telegram once.
+    Files are content-addressed (<root>/ab/cd/<sha256>.jpg); an SQLite
+    index maps file_id and file_unique_id to the hash, so the same photo
+    sent twice, or referenced by several submissions, is stored once and
+    never fetched again. Downloads stream to disk with aiofiles and are
+    hashed on the way; index queries run in a worker thread.
+    """
+
+    def __init__(self, bot: Bot, root=PHOTO_DIR):
+        self.bot = bot
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " file_id TEXT PRIMARY KEY,"
+            " file_unique_id TEXT NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " stored_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_unique ON files (file_unique_id)")
+        self._fetching = {}   # file_id -> task, so concurrent requests share one download
+        self._tmp_ids = itertools.count()
+        self.stats = {'downloaded': 0, 'hits': 0, 'deduplicated': 0, 'bytes_downloaded': 0}
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], f"{sha256}.jpg")
+
+    # --- INDEX ---
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()
+
+    def _record(self, file_id, file_unique_id, sha256, size):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO files (file_id, file_unique_id, sha256, size, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (file_id, file_unique_id, sha256, size, time.time()))
+
+    # --- FETCH ---
+    async def fetch(self, file_id):
+        """Make sure the photo is on disk; returns (sha256, size)."""
+        row = await asyncio.to_thread(self._query, "SELECT sha256, size FROM files WHERE file_id = ?", (file_id,))
+        if row:
+            self.stats['hits'] += 1
+            return row
+        task = self._fetching.get(file_id)
+        if task is None:
+            task = self._fetching[file_id] = asyncio.ensure_future(self._fetch(file_id))
+            task.add_done_callback(lambda _: self._fetching.pop(file_id, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, file_id):
+        file = await self.bot.get_file(file_id)
+        # The same photo forwarded or re-sent gets a new file_id but keeps its file_unique_id
+        row = await asyncio.to_thread(
+            self._query, "SELECT sha256, size FROM files WHERE file_unique_id = ?", (file.file_unique_id,))
+        if row and await aiofiles.os.path.exists(self.path(row[0])):
+            self.stats['deduplicated'] += 1
+            sha256, size = row
+        else:
+            sha256, size = await self._download(file.file_path)
+        await asyncio.to_thread(self._record, file_id, file.file_unique_id, sha256, size)
+        return sha256, size
+
+    async def _chunks(self, file_path):
+        api = self.bot.session.api
+        if api.is_local:
+            async with aiofiles.open(api.wrap_local_file.to_local(file_path), 'rb') as f:
+                while chunk := await f.read(CHUNK_SIZE):
+                    yield chunk
+        else:
+            async for chunk in self.bot.session.stream_content(
+                    url=api.file_url(self.bot.token, file_path), chunk_size=CHUNK_SIZE, raise_for_status=True):
+                yield chunk
+
+    async def _download(self, file_path):
+        tmp = os.path.join(self.root, f".{os.getpid()}-{next(self._tmp_ids)}.part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(tmp, 'wb') as f:
+                async for chunk in self._chunks(file_path):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await f.write(chunk)
+            sha256 = digest.hexdigest()
+            dest = self.path(sha256)
+            if await aiofiles.os.path.exists(dest):
+                # Identical bytes under a different file_unique_id
+                self.stats['deduplicated'] += 1
+                await aiofiles.os.remove(tmp)
+            else:
+                await aiofiles.os.makedirs(os.path.dirname(dest), exist_ok=True)
+                await aiofiles.os.replace(tmp, dest)
+        except BaseException:
+            if await aiofiles.os.path.exists(tmp):
+                await aiofiles.os.remove(tmp)
+            raise
+        self.stats['downloaded'] += 1
+        self.stats['bytes_downloaded'] += size
+        return sha256, size
+
+    async def read(self, file_id):
+        """The photo's bytes, from disk (fetched first if needed)."""
+        sha256, _ = await self.fetch(file_id)
+        async with aiofiles.open(self.path(sha256), 'rb') as f:
+            return await f.read()
+
+    async def fetch_many(self, file_ids):
+        """Fetch with bounded concurrency; returns {file_id: (sha256, size) or the exception}."""
+        slots = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def one(file_id):
+            async with slots:
+                try:
+                    return file_id, await self.fetch(file_id)
+                except Exception as e:
+                    return file_id, e
+
+        return dict(await asyncio.gather(*(one(f) for f in set(file_ids))))
+
+    # --- EXPORT ---
+    async def export(self, rows, dest_dir=EXPORT_DIR):
+        """
+        Write submissions (full rows from SubmissionStore.for_export) to one
+        ZIP: a folder of photos per submission plus manifest.csv (a row per
+        photo) and manifest.jsonl (a record per submission). Photos are
+        copied from disk in chunks, so memory use does not grow with the
+        batch. Returns (zip path, summary dict).
+        """
+        started = time.perf_counter()
+        plans = []
+        for row in rows:
+            data = json.loads(row['data'])
+            plans.append((row, submission_photos(data, row.get('payment_photo_id'))))
+        fetched = await self.fetch_many(file_id for _, photos in plans for *_, file_id in photos)
+
+        os.makedirs(dest_dir, exist_ok=True)
+        path = os.path.join(dest_dir, f"submissions-{time.strftime('%Y%m%d-%H%M%S')}.zip")
+        summary = await asyncio.to_thread(self._write_zip, path, plans, fetched)
+        summary['seconds'] = round(time.perf_counter() - started, 2)
+        return path, summary
+
+    def _write_zip(self, path, plans, fetched):
+        summary = {'submissions': 0, 'photos': 0, 'missing': 0, 'bytes': 0}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        # Manifests are spooled aside: zipfile allows one open entry at a time
+        with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_STORED) as zf, \
+                tempfile.SpooledTemporaryFile(max_size=1 << 20, mode='w+', newline='', encoding='utf-8') as table, \
+                tempfile.SpooledTemporaryFile(max_size=1 << 20, mode='w+', encoding='utf-8') as records:
+            writer = csv.DictWriter(table, fieldnames=MANIFEST_FIELDS)
+            writer.writeheader()
+            for row, photos in plans:
+                folder = f"{row['id']:06d}_{_slug(row['last_name'])}_{_slug(row['first_name'])}"
+                submitted = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(row['submitted_at']))
+                base = {'submission_id': row['id'], 'user_id': row['user_id'], 'username': row['username'],
+                        'status': row['status'], 'submitted_at': submitted}
+                entries = []
+                for role, name, gender, file_id in photos:
+                    result = fetched.get(file_id)
+                    entry = {'role': role, 'name': name, 'gender': gender, 'file': None, 'sha256': None, 'size': None}
+                    if isinstance(result, tuple):
+                        sha256, size = result
+                        entry.update(file=f"{folder}/{role}.jpg", sha256=sha256, size=size)
+                        zf.write(self.path(sha256), entry['file'])
+                        summary['photos'] += 1
+                        summary['bytes'] += size
+                    else:
+                        summary['missing'] += 1
+                    writer.writerow({**base, **entry})
+                    entries.append(entry)
+                records.write(json.dumps({**base, 'first_name': row['first_name'], 'last_name': row['last_name'],
+                                          'lang': row['lang'], 'photos': entries}, ensure_ascii=False) + "\n")
+                summary['submissions'] += 1
+
+            for name, spool in (("manifest.csv", table), ("manifest.jsonl", records)):
+                spool.seek(0)
+                with zf.open(name, 'w') as out, io.TextIOWrapper(out, encoding='utf-8', newline='') as text:
+                    shutil.copyfileobj(spool, text)
+        os.replace(tmp, path)
+        return summary
+
+    def snapshot(self):
+        return {**self.stats, 'fetching': len(self._fetching)}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
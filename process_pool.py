@@ -0,0 +1,77 @@
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import sys
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+def _ready(preload):
+    for name in preload:
+        importlib.import_module(name)
+
+
+class ProcessPool:
+    """
+    CPU-bound work (photo checks, dossier PDFs) in worker processes, off the
+    event loop. Workers are spawned, not forked: a forked child would inherit
+    the event loop, open sockets and SQLite handles. A spawned child normally
+    re-runs the parent's main script (bot.py) as __mp_main__, so workers are
+    started with __main__ hidden and only import the modules their tasks
+    live in. `start()` launches every worker and imports `preload` up front;
+    a pool broken by a dead worker is replaced on the next call.
+    """
+
+    def __init__(self, name, workers, preload=()):
+        self.name = name
+        self.workers = workers
+        self.preload = tuple(preload)
+        self._executor = None
+        self._warming = None
+
+    def _submit(self, executor, fn, *args):
+        # Spawn pools start their processes inside submit(); hide bot.py from them meanwhile
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            return asyncio.wrap_future(executor.submit(fn, *args))
+        finally:
+            sys.modules['__main__'] = main
+
+    def _ensure(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            # One task per worker, submitted at once, so every process starts now
+            self._warming = asyncio.gather(*(self._submit(self._executor, _ready, self.preload)
+                                             for _ in range(self.workers)), return_exceptions=True)
+        return self._executor
+
+    async def start(self):
+        """Start and warm up the workers (call at startup, so the first user does not wait)."""
+        started = time.perf_counter()
+        self._ensure()
+        errors = [r for r in await asyncio.shield(self._warming) if isinstance(r, BaseException)]
+        if errors:
+            logging.warning(f"{self.name} pool failed to start: {errors[0]!r}")
+            return
+        print(f"⚙️ {self.name} pool: {self.workers} workers ready in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    async def run(self, fn, *args):
+        executor = self._ensure()
+        try:
+            return await self._submit(executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died; the next call starts a fresh pool
+            if self._executor is executor:
+                self.close()
+            raise
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._warming = None
@@ -0,0 +1,55 @@
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+
+
+class FormSession:
+    """
+    FSM data for one update. Handlers read and change `data` in place and
+    call `set_state`; nothing touches storage until `commit()`.
+    """
+
+    def __init__(self, context: FSMContext, data: dict, state: str | None):
+        self._context = context
+        self.data = data
+        self.state = state
+        self._data_changed = False
+        self._state_changed = False
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def update(self, **kwargs):
+        self.data.update(kwargs)
+        self._data_changed = True
+
+    def touch(self):
+        # Call after mutating a nested value (e.g. data['children'].append(...))
+        self._data_changed = True
+
+    def set_state(self, state: State | str | None):
+        self.state = state.state if isinstance(state, State) else state
+        self._state_changed = True
+
+    async def commit(self):
+        if self._data_changed:
+            await self._context.set_data(self.data)
+            self._data_changed = False
+        if self._state_changed:
+            await self._context.set_state(self.state)
+            self._state_changed = False
+
+
+class FormSessionMiddleware(BaseMiddleware):
+    """Loads FSM data once per update and writes back a single merged change."""
+
+    async def __call__(self, handler, event, data):
+        context: FSMContext = data.get("state")
+        if context is None:
+            return await handler(event, data)
+
+        session = FormSession(context, await context.get_data(), data.get("raw_state"))
+        data["session"] = session
+        result = await handler(event, data)
+        await session.commit()
+        return result
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Mapping
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+import metrics
+
+STATE_COUNT_INTERVAL = 30.0
+
+
+class _Session:
+    __slots__ = ("chat_id", "user_id", "state", "data", "last_seen")
+
+    def __init__(self, chat_id, user_id, state=None, data=None):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.state = state
+        self.data = data or {}
+        self.last_seen = time.monotonic()
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage backed by a local SQLite file (WAL mode).
+
+    Sessions live in RAM while the user is active. Writes only mark the
+    session dirty; `flush()` persists every dirty session in one
+    transaction (called once per update by FlushMiddleware). Sessions idle
+    for longer than `idle_ttl` are dropped from RAM and reloaded from disk
+    on the user's next message.
+    """
+
+    def __init__(self, path="dvbot.sqlite3", idle_ttl=1800, flush_interval=2.0):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        self._sessions: dict[str, _Session] = {}
+        self._dirty: set[str] = set()
+        self._flush_lock = asyncio.Lock()
+        self._db_lock = threading.Lock()
+        self._task = None
+        self.state_counts = {}   # FSM state -> users saved in it, refreshed by the maintenance loop
+        self._counted_at = 0.0
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY,"
+            " chat_id INTEGER NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " state TEXT,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS fsm_updated ON fsm (updated_at)")
+
+    # --- DISK I/O (runs in a worker thread) ---
+    def _load_row(self, key):
+        with self._db_lock:
+            return self._db.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+
+    def _write_rows(self, rows):
+        with self._db_lock:
+            # Take the write lock up front: worker processes share this file
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT INTO fsm (key, chat_id, user_id, state, data, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    rows,
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _count_states(self):
+        with self._db_lock:
+            return dict(self._db.execute(
+                "SELECT state, COUNT(DISTINCT user_id) FROM fsm WHERE state IS NOT NULL GROUP BY state").fetchall())
+
+    # --- SESSION CACHE ---
+    async def _session(self, key: StorageKey) -> _Session:
+        skey = self.key_builder.build(key)
+        session = self._sessions.get(skey)
+        if session is None:
+            started = time.perf_counter()
+            row = await asyncio.to_thread(self._load_row, skey)
+            metrics.observe("dvbot_storage_seconds", time.perf_counter() - started, op='load')
+            # Another coroutine may have loaded it while we were waiting on disk
+            session = self._sessions.get(skey)
+            if session is None:
+                session = _Session(key.chat_id, key.user_id)
+                if row:
+                    session.state = row[0]
+                    session.data = json.loads(row[1])
+                self._sessions[skey] = session
+        session.last_seen = time.monotonic()
+        return session
+
+    def _mark_dirty(self, key: StorageKey):
+        self._dirty.add(self.key_builder.build(key))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        session = await self._session(key)
+        session.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._session(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        session = await self._session(key)
+        session.data = dict(data)
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict((await self._session(key)).data)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        async with self._flush_lock:
+            keys, self._dirty = self._dirty, set()
+            now = time.time()
+            rows = []
+            for skey in keys:
+                session = self._sessions.get(skey)
+                if session is not None:
+                    rows.append((skey, session.chat_id, session.user_id, session.state,
+                                 json.dumps(session.data, ensure_ascii=False), now))
+            if not rows:
+                return
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write_rows, rows)
+                metrics.observe("dvbot_storage_seconds", time.perf_counter() - started, op='flush')
+            except Exception:
+                # Keep them dirty so the next flush retries
+                self._dirty |= keys
+                raise
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        stale = [k for k, s in self._sessions.items() if s.last_seen < cutoff and k not in self._dirty]
+        for k in stale:
+            del self._sessions[k]
+        return len(stale)
+
+    def snapshot(self):
+        return {'cached_sessions': len(self._sessions), 'dirty_sessions': len(self._dirty)}
+
+    async def _maintenance(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                self.evict_idle()
+                if time.monotonic() - self._counted_at >= STATE_COUNT_INTERVAL:
+                    self._counted_at = time.monotonic()
+                    self.state_counts = await asyncio.to_thread(self._count_states)
+            except Exception as e:
+                print(f"❌ Storage flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintenance())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        with self._db_lock:
+            self._db.close()
+
+
+class FlushMiddleware(BaseMiddleware):
+    """Outer update middleware: persist everything the update changed in one write."""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            await self.storage.flush()
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+PENDING, APPROVED = 'pending', 'approved'
+
+
+class SubmissionStore:
+    """
+    Completed applications in a local SQLite file (WAL), indexed by status,
+    user and submission time. Queries run in a worker thread like the FSM
+    storage, so the event loop never waits on disk.
+    """
+
+    def __init__(self, path="submissions.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id INTEGER NOT NULL,"
+            " username TEXT,"
+            " lang TEXT,"
+            " first_name TEXT,"
+            " last_name TEXT,"
+            " payment_photo_id TEXT,"
+            " data TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " submitted_at REAL NOT NULL,"
+            " approved_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_status ON submissions (status, submitted_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_user ON submissions (user_id, submitted_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_time ON submissions (submitted_at)")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params).fetchall()]
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cur = self._db.execute(sql, params)
+            return cur.lastrowid, cur.rowcount
+
+    async def add(self, user_id, username, data, payment_photo_id):
+        row_id, _ = await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO submissions (user_id, username, lang, first_name, last_name, payment_photo_id, data, submitted_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, username, data.get('lang'), data.get('first_name'), data.get('last_name'),
+             payment_photo_id, json.dumps(data, ensure_ascii=False), time.time()),
+        )
+        return row_id
+
+    async def get(self, submission_id):
+        rows = await asyncio.to_thread(self._query, "SELECT * FROM submissions WHERE id = ?", (submission_id,))
+        return rows[0] if rows else None
+
+    async def list_by_status(self, status=PENDING, limit=10, offset=0):
+        # Oldest first, so the admin works through the backlog in order
+        return await asyncio.to_thread(
+            self._query,
+            "SELECT id, user_id, username, lang, first_name, last_name, status, submitted_at FROM submissions"
+            " WHERE status = ? ORDER BY submitted_at LIMIT ? OFFSET ?",
+            (status, limit, offset),
+        )
+
+    async def for_export(self, ids=None, status=None, limit=None):
+        """Full rows, form data included, oldest first: the given ids, or by status (None for all)."""
+        if ids is not None:
+            if not ids:
+                return []
+            sql, params = f"SELECT * FROM submissions WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+        elif status is not None:
+            sql, params = "SELECT * FROM submissions WHERE status = ?", [status]
+        else:
+            sql, params = "SELECT * FROM submissions", []
+        sql += " ORDER BY submitted_at"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return await asyncio.to_thread(self._query, sql, params)
+
+    async def count(self, status=PENDING):
+        rows = await asyncio.to_thread(self._query, "SELECT COUNT(*) AS n FROM submissions WHERE status = ?", (status,))
+        return rows[0]['n']
+
+    async def by_user(self, user_id=None, username=None, limit=20):
+        if username is not None:
+            sql, params = "SELECT * FROM submissions WHERE username = ? ORDER BY submitted_at DESC LIMIT ?", (username, limit)
+        else:
+            sql, params = "SELECT * FROM submissions WHERE user_id = ? ORDER BY submitted_at DESC LIMIT ?", (user_id, limit)
+        return await asyncio.to_thread(self._query, sql, params)
+
+    async def approve(self, ids):
+        """Mark the given pending submissions approved; return the rows that actually changed."""
+        if not ids:
+            return []
+
+        def run():
+            marks = ",".join("?" * len(ids))
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = [dict(r) for r in self._db.execute(
+                        f"SELECT id, user_id, lang FROM submissions WHERE status = ? AND id IN ({marks})",
+                        (PENDING, *ids)).fetchall()]
+                    self._db.execute(
+                        f"UPDATE submissions SET status = ?, approved_at = ? WHERE status = ? AND id IN ({marks})",
+                        (APPROVED, time.time(), PENDING, *ids))
+                    self._db.execute("COMMIT")
+                except Exception:
+                    self._db.execute("ROLLBACK")
+                    raise
+            return rows
+
+        return await asyncio.to_thread(run)
+
+    async def approve_oldest(self, n):
+        pending = await self.list_by_status(PENDING, limit=n)
+        return await self.approve([row['id'] for row in pending])
+
+    async def pending_ids_for_user(self, user_id):
+        rows = await asyncio.to_thread(
+            self._query, "SELECT id FROM submissions WHERE user_id = ? AND status = ?", (user_id, PENDING))
+        return [row['id'] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -37,7 +37,30 @@ TRANS = {
         'btn_edit': "❌ Start Over",
         'payment_msg': "🛡️ **Payment & Guarantee**\n\nTotal Fee: **300 ETB**.\n\n🏦 CBE: 1000583686111\n📱 Telebirr: 0996246990\n\nPlease send the screenshot here:",
         'wait_approval': "⏳ **Received!** We are verifying your payment...",
-        'approved': "✅ **APPROVED!**\n\nThank you! We have received your payment and your data."
+        'approved': "✅ **APPROVED!**\n\nThank you! We have received your payment and your data.",
+        # --- PHOTO REMINDERS (text sent instead of a photo) ---
+        'need_photo_spouse': "📸 Please upload your **Spouse's Photo** as an image (not text) to continue.",
+        'need_photo_child': "📸 Please upload the **Photo for Child {n}** as an image (not text) to continue.",
+        'need_photo_main': "📸 Please upload **YOUR Photo** as an image (not text) to continue.",
+        'need_photo_payment': "🧾 Please send the **payment screenshot** as an image (not text) to continue.",
+        'need_photo': "📸 Please send a photo to continue.",
+        # --- VALIDATION ERRORS ---
+        'err_use_buttons': "⚠️ Please select one of the buttons below:",
+        'err_name_short': "⚠️ Name too short. Please enter valid name.",
+        'err_need_text': "⚠️ Please type your answer as text.",
+        'err_number': "Please enter a number (e.g., 1, 2).",
+        'err_child_count': "Please enter a realistic number (1-20).",
+        # --- PHOTO CHECK ---
+        'photo_issues_title': "🔎 **Photo check for {label}:**",
+        'photo_too_small': "• The photo is too small (at least 600x600 pixels).",
+        'photo_not_square': "• The photo must be square (same width and height).",
+        'photo_background': "• The background must be plain white.",
+        'photo_too_dark': "• The photo is too dark.",
+        'photo_too_bright': "• The photo is overexposed (too bright).",
+        'photo_not_centered': "• The face must be in the centre of the photo.",
+        'photo_unreadable': "• We could not read this image.",
+        'photo_retry': "Please send a new photo.",
+        'photo_accepted_anyway': "We saved it, but a better photo may be requested later."
     },
     'am': {
         'welcome': "እንኳን ወደ DV-2027 ረዳት ቦት በሰላም መጡ! 🇺🇸\nእባክዎ ቋንቋ ይምረጡ፡",
@@ -75,6 +98,29 @@ TRANS = {
         'btn_edit': "❌ እንደገና ለመጀመር",
         'payment_msg': "🛡️ **ክፍያ እና ዋስትና**\n\nጠቅላላ ክፍያ: **300 ብር**.\n\n🏦 CBE: 1000583686111\n📱 Telebirr: 0996246990\n\nእባክዎ የከፈሉበትን ስክሪንሹት ይላኩ:",
         'wait_approval': "⏳ **ተቀብለናል!** ክፍያዎን እያረጋገጥን ነው ይጠብቁ...",
-        'approved': "✅ **ተረጋግጧል!**\n\nእናመሰግናለን! ክፍያዎ እና መረጃዎ ደርሶናል።"
+        'approved': "✅ **ተረጋግጧል!**\n\nእናመሰግናለን! ክፍያዎ እና መረጃዎ ደርሶናል።",
+        # --- PHOTO REMINDERS (text sent instead of a photo) ---
+        'need_photo_spouse': "📸 ለመቀጠል የባለቤትዎን **ፎቶ** እንደ ምስል ይላኩ (ጽሁፍ አይደለም)።",
+        'need_photo_child': "📸 ለመቀጠል የልጅ {n} **ፎቶ** እንደ ምስል ይላኩ (ጽሁፍ አይደለም)።",
+        'need_photo_main': "📸 ለመቀጠል **የራስዎን ፎቶ** እንደ ምስል ይላኩ (ጽሁፍ አይደለም)።",
+        'need_photo_payment': "🧾 ለመቀጠል የከፈሉበትን **ስክሪንሹት** እንደ ምስል ይላኩ (ጽሁፍ አይደለም)።",
+        'need_photo': "📸 ለመቀጠል እባክዎ ፎቶ ይላኩ።",
+        # --- VALIDATION ERRORS ---
+        'err_use_buttons': "⚠️ እባክዎ ከታች ካሉት ቁልፎች አንዱን ይምረጡ:",
+        'err_name_short': "⚠️ ስሙ በጣም አጭር ነው። እባክዎ ትክክለኛ ስም ያስገቡ።",
+        'err_need_text': "⚠️ እባክዎ መልስዎን በጽሁፍ ይጻፉ።",
+        'err_number': "እባክዎ ቁጥር ያስገቡ (ለምሳሌ 1, 2)።",
+        'err_child_count': "እባክዎ ትክክለኛ ቁጥር ያስገቡ (1-20)።",
+        # --- PHOTO CHECK ---
+        'photo_issues_title': "🔎 **የፎቶ ማረጋገጫ ({label}):**",
+        'photo_too_small': "• ፎቶው በጣም ትንሽ ነው (ቢያንስ 600x600 ፒክሰል)።",
+        'photo_not_square': "• ፎቶው ካሬ መሆን አለበት (እኩል ቁመት እና ስፋት)።",
+        'photo_background': "• መደቡ (Background) ነጭ መሆን አለበት።",
+        'photo_too_dark': "• ፎቶው በጣም ጨለማ ነው።",
+        'photo_too_bright': "• ፎቶው ከመጠን በላይ ብሩህ ነው።",
+        'photo_not_centered': "• ፊት በፎቶው መሃል ላይ መሆን አለበት።",
+        'photo_unreadable': "• ምስሉን ማንበብ አልቻልንም።",
+        'photo_retry': "እባክዎ አዲስ ፎቶ ይላኩ።",
+        'photo_accepted_anyway': "ፎቶውን አስቀምጠናል፣ ነገር ግን የተሻለ ፎቶ በኋላ ልንጠይቅዎ እንችላለን።"
     }
 }
\ No newline at end of file
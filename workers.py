@@ -0,0 +1,404 @@
+"""
+Multi-process mode: one supervisor receives updates (webhook or long
+polling) and hands each to one of N worker processes, chosen by chat id, so
+a chat is always served by the same worker and its FSM session lives in one
+RAM cache only. Workers run the normal bot (bot.py) against the shared
+SQLite files.
+
+    BOT_WORKERS=4 python workers.py
+
+SIGHUP restarts the workers one at a time (each finishes its in-flight
+updates first; updates for it queue up meanwhile and go to its successor). SIGTERM / Ctrl+C stops
+everything gracefully. A worker that dies or stops reporting is restarted.
+Per-worker stats: /workers (JSON) and /metrics.
+"""
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+TOKEN = os.getenv("BOT_TOKEN")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+BOT_WORKERS = int(os.getenv("BOT_WORKERS") or os.cpu_count() or 1)
+
+ALLOWED_UPDATES = ["message", "callback_query"]
+STATS_INTERVAL = 2.0
+# A worker that has not reported for this long is considered hung and killed
+HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", 30))
+# In-flight updates get this long to finish when a worker is stopped
+DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", 30))
+MAX_RESTART_DELAY = 30
+
+
+def raw_chat_id(update):
+    """Chat id of a raw update dict; same rules as chat_queue.update_chat_id."""
+    for key in ("message", "edited_message", "callback_query", "my_chat_member"):
+        event = update.get(key)
+        if not event:
+            continue
+        message = event.get("message") or event
+        if "chat" in message:
+            return message["chat"]["id"]
+        if "from" in event:
+            return event["from"]["id"]
+    return None
+
+
+def worker_env(count):
+    """Limits that are per bot (or per machine) are split between the workers."""
+    from delivery import PER_CHAT_RATE
+
+    env = {
+        "TELEGRAM_GLOBAL_RATE": str(float(os.getenv("TELEGRAM_GLOBAL_RATE", 25)) / count),
+        # Every worker sends to the admin chat
+        "SHARED_CHAT_RATE": str(float(os.getenv("SHARED_CHAT_RATE", PER_CHAT_RATE)) / count),
+    }
+    for name, default in (("AI_MAX_CONCURRENCY", 4), ("AI_MAX_QUEUE", 50)):
+        env[name] = str(max(1, math.ceil(int(os.getenv(name, default)) / count)))
+    # Each worker has its own photo check / dossier pools
+    env.setdefault("PHOTO_CHECK_WORKERS", os.getenv("PHOTO_CHECK_WORKERS", "1"))
+    env.setdefault("DOSSIER_WORKERS", os.getenv("DOSSIER_WORKERS", "1"))
+    return env
+
+
+# --- WORKER PROCESS ---
+def run_worker(index, updates, stats, env):
+    os.environ.update(env)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # the supervisor decides when to stop
+    asyncio.run(_worker(index, updates, stats))
+
+
+async def _worker(index, updates, stats):
+    import bot as app
+
+    loop = asyncio.get_running_loop()
+    inbox = asyncio.Queue()
+
+    def reader():
+        # mp.Queue.get blocks, so it runs in a thread and hands over to the loop.
+        # The stop signal is this process's pid; one meant for a predecessor
+        # that died before reading it is skipped.
+        while True:
+            item = updates.get()
+            if isinstance(item, int):
+                if item != os.getpid():
+                    continue
+                item = None
+            loop.call_soon_threadsafe(inbox.put_nowait, item)
+            if item is None:
+                return
+
+    threading.Thread(target=reader, name="updates", daemon=True).start()
+
+    app.storage.start()
+    app.outbox.start()
+    await app.dp.emit_startup(bot=app.bot)
+
+    counters = {'handled': 0, 'errors': 0}
+    tasks = set()
+
+    async def handle(data):
+        try:
+            await app.dp.feed_raw_update(app.bot, data)
+        except Exception:
+            counters['errors'] += 1   # already logged by aiogram
+        finally:
+            counters['handled'] += 1
+
+    def report(final=False):
+        stats.put((index, os.getpid(), {
+            **counters,
+            'in_flight': len(tasks),
+            'inbox': inbox.qsize(),
+            'chat_queue': app.dp.sequencer.snapshot(),
+            'ai_scheduler': app.scheduler.snapshot(),
+            'outbox_queue': app.outbox.queue.qsize(),
+            'storage': app.storage.snapshot(),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'final': final,
+        }))
+
+    async def reporter():
+        while True:
+            report()
+            await asyncio.sleep(STATS_INTERVAL)
+
+    reporting = asyncio.create_task(reporter())
+    print(f"👷 Worker {index} ready (pid {os.getpid()})")
+    while True:
+        data = await inbox.get()
+        if data is None:
+            break
+        task = asyncio.create_task(handle(data))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks, timeout=DRAIN_TIMEOUT)
+    reporting.cancel()
+    # Shutdown hooks flush and close storage, drain the outbox and stop the pools
+    await app.dp.emit_shutdown(bot=app.bot)
+    await app.bot.session.close()
+    report(final=True)
+    print(f"👋 Worker {index} stopped after {counters['handled']} updates")
+
+
+# --- SUPERVISOR ---
+class Worker:
+    __slots__ = ("index", "updates", "process", "started", "restarts", "routed", "report", "last_report",
+                 "retiring", "next_start")
+
+    def __init__(self, index, updates):
+        self.index = index
+        self.updates = updates    # handed on to the successor when the worker stopped cleanly
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.routed = 0
+        self.report = {}
+        self.last_report = 0.0
+        self.retiring = False     # being stopped on purpose; the monitor leaves it alone
+        self.next_start = 0.0
+
+
+class Supervisor:
+    def __init__(self, count):
+        self.count = count
+        self.ctx = multiprocessing.get_context("spawn")
+        self.target = run_worker
+        self.stats = self.ctx.Queue()
+        self.workers = [Worker(i, self.ctx.Queue()) for i in range(count)]
+        self.env = worker_env(count)
+        self.stopping = False
+        self.unrouted = 0
+
+    def route(self, update):
+        chat_id = raw_chat_id(update)
+        if chat_id is None:
+            chat_id = update.get("update_id", 0)
+            self.unrouted += 1
+        worker = self.workers[chat_id % self.count]
+        worker.updates.put(update)
+        worker.routed += 1
+
+    def spawn(self, worker):
+        if worker.process is not None and worker.process.exitcode != 0:
+            # A worker that died abruptly may have held the queue's read lock;
+            # the queue is unusable then, and whatever it still held is lost
+            logging.warning(f"Worker {worker.index} died, updates still queued for it are dropped")
+            worker.updates.cancel_join_thread()
+            worker.updates.close()
+            worker.updates = self.ctx.Queue()
+        worker.process = self.ctx.Process(target=self.target, name=f"dvbot-worker-{worker.index}",
+                                          args=(worker.index, worker.updates, self.stats, self.env))
+        worker.process.start()
+        worker.started = worker.last_report = time.monotonic()
+        worker.report = {}
+
+    async def stop_worker(self, worker):
+        """Let the worker finish what it has, then wait for it to exit."""
+        worker.retiring = True
+        if not worker.process.is_alive():
+            return
+        worker.updates.put(worker.process.pid)
+        await asyncio.to_thread(worker.process.join, DRAIN_TIMEOUT + 15)
+        if worker.process.is_alive():
+            logging.warning(f"Worker {worker.index} did not stop in time, killing it")
+            worker.process.kill()
+            await asyncio.to_thread(worker.process.join)
+
+    async def rolling_restart(self):
+        print("🔄 Rolling restart of all workers...")
+        for worker in self.workers:
+            if self.stopping:
+                return
+            await self.stop_worker(worker)
+            if self.stopping:
+                return
+            self.spawn(worker)
+            worker.retiring = False
+            worker.restarts += 1
+        print("🔄 Rolling restart done")
+
+    def collect_stats(self, loop):
+        while True:
+            item = self.stats.get()
+            if item is None:
+                return
+            try:
+                loop.call_soon_threadsafe(self._on_report, *item)
+            except RuntimeError:   # loop already closed
+                return
+
+    def _on_report(self, index, pid, report):
+        worker = self.workers[index]
+        if worker.process is not None and worker.process.pid == pid:
+            worker.report = report
+            worker.last_report = time.monotonic()
+
+    async def monitor(self):
+        while not self.stopping:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.retiring or self.stopping:
+                    continue
+                if worker.process.is_alive():
+                    if now - worker.last_report > HEARTBEAT_TIMEOUT:
+                        logging.warning(f"Worker {worker.index} sent no stats for {HEARTBEAT_TIMEOUT:.0f}s, killing it")
+                        worker.process.kill()
+                    continue
+                if not worker.next_start:
+                    # Back off when a worker keeps crashing right after start
+                    quick = now - worker.started < 60
+                    delay = min(MAX_RESTART_DELAY, 2 ** worker.restarts) if quick else 0
+                    logging.warning(f"Worker {worker.index} exited with code {worker.process.exitcode}, "
+                                    f"restarting in {delay}s")
+                    worker.next_start = now + delay
+                if now >= worker.next_start:
+                    worker.next_start = 0.0
+                    worker.restarts += 1
+                    self.spawn(worker)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            'workers': self.count,
+            'unrouted': self.unrouted,
+            'per_worker': [{
+                'index': w.index,
+                'pid': w.process.pid if w.process else None,
+                'alive': bool(w.process and w.process.is_alive()),
+                'uptime': round(now - w.started, 1),
+                'restarts': w.restarts,
+                'routed': w.routed,
+                'report_age': round(now - w.last_report, 1),
+                **w.report,
+            } for w in self.workers],
+        }
+
+    def gauge(self):
+        values = {}
+        now = time.monotonic()
+        for w in self.workers:
+            worker = str(w.index)
+            values[(worker, 'alive')] = int(bool(w.process and w.process.is_alive()))
+            values[(worker, 'restarts')] = w.restarts
+            values[(worker, 'routed')] = w.routed
+            values[(worker, 'report_age')] = round(now - w.last_report, 1)
+            for key, value in w.report.items():
+                if isinstance(value, dict):
+                    for sub, v in value.items():
+                        values[(worker, f"{key}_{sub}")] = v
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[(worker, key)] = value
+        return values
+
+    async def shutdown(self):
+        self.stopping = True
+        print("🛑 Stopping workers...")
+        await asyncio.gather(*(self.stop_worker(w) for w in self.workers if w.process))
+        self.stats.put(None)
+
+
+async def workers_view(request):
+    return web.json_response(request.app['supervisor'].snapshot())
+
+
+async def poll(bot, supervisor):
+    offset = None
+    delay = 1
+    while not supervisor.stopping:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=ALLOWED_UPDATES)
+        except Exception as e:
+            logging.warning(f"Failed to fetch updates ({type(e).__name__}: {e}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+            continue
+        delay = 1
+        for update in updates:
+            offset = update.update_id + 1
+            supervisor.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+
+def webhook_handler(supervisor):
+    async def handler(request):
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        if supervisor.stopping:
+            return web.Response(status=503)   # Telegram redelivers it later
+        supervisor.route(await request.json())
+        return web.Response()
+    return handler
+
+
+async def main():
+    from aiogram import Bot
+
+    import metrics
+    from keep_alive import build_app, start_server
+
+    if not TOKEN:
+        print("Error: BOT_TOKEN not found!")
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    supervisor = Supervisor(BOT_WORKERS)
+    loop = asyncio.get_running_loop()
+    threading.Thread(target=supervisor.collect_stats, args=(loop,), name="worker-stats", daemon=True).start()
+    for worker in supervisor.workers:
+        supervisor.spawn(worker)
+    print(f"🧩 Started {BOT_WORKERS} workers, chats sharded by chat id")
+
+    metrics.registry.gauge("dvbot_worker", supervisor.gauge, label=('worker', 'stat'),
+                           help="Per-worker process stats reported to the supervisor")
+    app = build_app()
+    app['supervisor'] = supervisor
+    app.router.add_get('/workers', workers_view)
+
+    bot = Bot(token=TOKEN)
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(supervisor.rolling_restart()))
+
+    if WEBHOOK_URL:
+        app.router.add_post(WEBHOOK_PATH, webhook_handler(supervisor))
+        runner = await start_server(app)
+        await bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET,
+                              max_connections=100, allowed_updates=ALLOWED_UPDATES)
+        print(f"🤖 Bot is running (webhook {WEBHOOK_PATH}, {BOT_WORKERS} workers)...")
+        intake = None
+    else:
+        runner = await start_server(app)
+        await bot.delete_webhook()
+        print(f"🤖 Bot is running ({BOT_WORKERS} workers)...")
+        intake = asyncio.create_task(poll(bot, supervisor))
+
+    monitoring = asyncio.create_task(supervisor.monitor())
+    try:
+        await stop.wait()
+    finally:
+        if intake:
+            intake.cancel()
+        monitoring.cancel()
+        await supervisor.shutdown()
+        await runner.cleanup()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))